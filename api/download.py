@@ -1,43 +1,433 @@
 from http.server import BaseHTTPRequestHandler
 import urllib.parse
 import base64
+import binascii
+import re
+import tempfile
+
+# Request bodies are read and written in chunks of this size, so memory use does not grow with the file
+CHUNK_SIZE = 64 * 1024
+# Decoded output that has to be held back (file data sent before its filename) spills to disk past this size
+SPOOL_MAX_MEMORY = 1024 * 1024
+# Upper bound for small text fields (filename) and multipart part headers
+MAX_FIELD_SIZE = 16 * 1024
+DEFAULT_FILENAME = 'download.bin'
+DEFAULT_MIME_TYPE = 'application/octet-stream'
+
+
+class Base64StreamDecoder:
+    """Decodes base64 text fed in arbitrary pieces, emitting bytes in 4-character groups"""
+    def __init__(self):
+        self.pending = b''
+
+    def feed(self, data):
+        # b64decode ignores characters outside the alphabet, so drop them before grouping
+        data = self.pending + re.sub(rb'[^A-Za-z0-9+/=]', b'', data)
+        usable = len(data) - len(data) % 4
+        self.pending = data[usable:]
+        return base64.b64decode(data[:usable]) if usable else b''
+
+    def flush(self):
+        data, self.pending = self.pending, b''
+        if not data:
+            return b''
+        # Same leniency as base64.b64decode on the whole payload: pad a truncated tail
+        try:
+            return base64.b64decode(data + b'=' * (-len(data) % 4))
+        except binascii.Error:
+            return b''
+
+
+class DataUriStreamDecoder:
+    """
+    Decodes a data URI (data:mime/type;base64,....) fed in pieces.
+    The MIME type is known once the header up to the first ',' has been seen.
+    """
+    def __init__(self):
+        self.header = b''
+        self.mime_type = None
+        self.decoder = None
+
+    def feed(self, data):
+        if self.decoder is None:
+            self.header += data
+            if b',' not in self.header:
+                if len(self.header) > MAX_FIELD_SIZE:
+                    raise ValueError("Invalid data URI")
+                return b''
+            header, data = self.header.split(b',', 1)
+            header = header.decode('ascii', 'replace')
+            self.mime_type = header.split(':', 1)[1].split(';')[0] if ':' in header else DEFAULT_MIME_TYPE
+            # Non-base64 data URIs are percent-encoded text (RFC 2397)
+            self.decoder = Base64StreamDecoder() if ';base64' in header else PercentStreamDecoder(plus_as_space=False)
+        return self.decoder.feed(data)
+
+    def flush(self):
+        if self.decoder is None:
+            raise ValueError("Invalid data URI")
+        return self.decoder.flush()
+
+
+class _PassThrough:
+    def feed(self, data):
+        return data
+
+    def flush(self):
+        return b''
+
+
+class PercentStreamDecoder:
+    """application/x-www-form-urlencoded value decoding ('+' and %XX) for values split across chunks"""
+    def __init__(self, plus_as_space=True):
+        self.plus_as_space = plus_as_space
+        self.pending = b''
+
+    def _decode(self, data):
+        if self.plus_as_space:
+            data = data.replace(b'+', b' ')
+        return urllib.parse.unquote_to_bytes(data)
+
+    def feed(self, data):
+        data = self.pending + data
+        # Hold back an escape sequence cut off at the end of the chunk
+        cut = data.rfind(b'%', max(0, len(data) - 2))
+        if cut != -1:
+            data, self.pending = data[:cut], data[cut:]
+        else:
+            self.pending = b''
+        return self._decode(data)
+
+    def flush(self):
+        data, self.pending = self.pending, b''
+        return self._decode(data)
+
+
+class DownloadResponse:
+    """
+    Writes the file back to the client. With a known length it sends Content-Length;
+    otherwise the body is chunked (HTTP/1.1) or delimited by closing the connection (HTTP/1.0).
+    """
+    def __init__(self, handler, filename, mime_type, length=None):
+        self.handler = handler
+        self.chunked = length is None and handler.request_version == 'HTTP/1.1'
+        if self.chunked:
+            handler.protocol_version = 'HTTP/1.1'
+        handler.send_response(200)
+        handler.send_header('Content-Type', mime_type or DEFAULT_MIME_TYPE)
+        # This header forces the Android Download Manager to wake up
+        handler.send_header('Content-Disposition', f'attachment; filename="{safe_filename(filename)}"')
+        if length is not None:
+            handler.send_header('Content-Length', str(length))
+        elif self.chunked:
+            handler.send_header('Transfer-Encoding', 'chunked')
+        handler.send_header('Connection', 'close')
+        handler.end_headers()
+        handler.close_connection = True
+
+    def write(self, data):
+        if not data:
+            return
+        if self.chunked:
+            self.handler.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+        else:
+            self.handler.wfile.write(data)
+
+    def finish(self):
+        if self.chunked:
+            self.handler.wfile.write(b"0\r\n\r\n")
+        self.handler.wfile.flush()
+
+
+def safe_filename(filename):
+    """Keeps the filename from breaking out of the Content-Disposition header"""
+    return re.sub(r'["\r\n\\]', '_', filename or DEFAULT_FILENAME)
+
+
+class FileSink:
+    """
+    Receives decoded file bytes. Streams straight to the client once the filename and MIME type
+    are known; until then output is held in a spooled temporary file (bounded memory).
+    """
+    def __init__(self, handler):
+        self.handler = handler
+        self.filename = None
+        self.mime_type = None
+        self.response = None
+        self.spool = None
+        self.received = False
+
+    def ready(self):
+        return self.filename is not None and self.mime_type is not None
+
+    def write(self, data):
+        if not data:
+            return
+        if self.response is None and self.ready():
+            self.response = DownloadResponse(self.handler, self.filename, self.mime_type)
+            if self.spool is not None:
+                self._drain_spool()
+        if self.response is not None:
+            self.response.write(data)
+            return
+        if self.spool is None:
+            self.spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+        self.spool.write(data)
+
+    def _drain_spool(self):
+        self.spool.seek(0)
+        for chunk in iter(lambda: self.spool.read(CHUNK_SIZE), b''):
+            self.response.write(chunk)
+        self.spool.close()
+        self.spool = None
+
+    def finish(self):
+        if self.response is None:
+            # Everything was spooled, so the length is known
+            length = self.spool.tell() if self.spool is not None else 0
+            self.response = DownloadResponse(self.handler, self.filename or DEFAULT_FILENAME, self.mime_type, length)
+            if self.spool is not None:
+                self._drain_spool()
+        self.response.finish()
+
 
 class handler(BaseHTTPRequestHandler):
     def do_POST(self):
+        self.sink = None
         try:
-            # 1. Get the data sent from the website
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            
-            # 2. Parse the Form Data
-            fields = urllib.parse.parse_qs(post_data.decode('utf-8'))
-            
-            # Get filename and content (Handle lists returned by parse_qs)
-            filename = fields.get('filename', ['download.bin'])[0]
-            data_uri = fields.get('fileData', [''])[0]
-            
-            if not data_uri:
-                self.send_error(400, "No file data provided")
-                return
+            # 1. Pick the upload format from the request's Content-Type
+            content_type = self.headers.get('Content-Type', '')
+            self.remaining = int(self.headers.get('Content-Length') or 0)
+
+            if content_type.startswith('application/x-www-form-urlencoded'):
+                self.handle_form()
+            elif content_type.startswith('multipart/form-data'):
+                boundary = re.search(r'boundary="?([^";]+)"?', content_type)
+                if not boundary:
+                    self.send_error(400, "Missing multipart boundary")
+                    return
+                self.handle_multipart(boundary.group(1).encode())
+            else:
+                self.handle_raw(content_type)
 
-            # 3. Process Data URI (Format: data:mime/type;base64,.....)
-            header, content = data_uri.split(',', 1)
-            mime_type = header.split(':')[1].split(';')[0]
-            
-            # Decode the base64 content back to binary
-            file_content = base64.b64decode(content)
-
-            # 4. Send it back as a downloadable file
-            self.send_response(200)
-            self.send_header('Content-Type', mime_type)
-            # This header forces the Android Download Manager to wake up
-            self.send_header('Content-Disposition', f'attachment; filename="{filename}"')
-            self.send_header('Content-Length', str(len(file_content)))
-            self.end_headers()
-            
-            self.wfile.write(file_content)
-            
         except Exception as e:
+            if self.sink is not None and self.sink.response is not None:
+                # Headers are already out; all we can do is cut the transfer short
+                self.close_connection = True
+                return
             self.send_response(500)
             self.end_headers()
             self.wfile.write(str(e).encode())
+
+    def read_chunks(self):
+        """Yields the request body in CHUNK_SIZE pieces"""
+        while self.remaining > 0:
+            chunk = self.rfile.read(min(CHUNK_SIZE, self.remaining))
+            if not chunk:
+                break
+            self.remaining -= len(chunk)
+            yield chunk
+
+    def query_filename(self):
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+        return query.get('filename', [None])[0] or self.headers.get('X-Filename')
+
+    def handle_raw(self, content_type):
+        """Raw binary upload: the body is the file, so it is copied through with its own length"""
+        if self.remaining <= 0:
+            self.send_error(400, "No file data provided")
+            return
+        mime_type = content_type.split(';')[0].strip() or DEFAULT_MIME_TYPE
+        self.sink = FileSink(self)
+        self.sink.response = DownloadResponse(self, self.query_filename() or DEFAULT_FILENAME, mime_type, self.remaining)
+        for chunk in self.read_chunks():
+            self.sink.response.write(chunk)
+        self.sink.response.finish()
+
+    def handle_form(self):
+        """
+        Form upload with 'filename' and 'fileData' (a data URI), parsed as the body streams in.
+        The data URI is percent-decoded and base64-decoded chunk by chunk.
+        """
+        self.sink = FileSink(self)
+        fields = {}
+        name, value = b'', b''
+        in_value = False
+        decoder = percent = None
+
+        def end_field():
+            nonlocal decoder, percent
+            key = urllib.parse.unquote_plus(name.decode('ascii', 'replace'))
+            if decoder is not None:
+                if decoder.header or decoder.decoder is not None:
+                    self.feed_file(decoder, percent.flush())
+                    self.sink.write(decoder.flush())
+                decoder = percent = None
+            else:
+                fields[key] = urllib.parse.unquote_plus(value.decode('ascii', 'replace'))
+                if key == 'filename':
+                    self.sink.filename = fields[key]
+
+        for chunk in self.read_chunks():
+            position = 0
+            while position < len(chunk):
+                if not in_value:
+                    end = re.compile(rb'[=&]').search(chunk, position)
+                    if end is None:
+                        name += chunk[position:]
+                        break
+                    name += chunk[position:end.start()]
+                    position = end.end()
+                    if end.group() == b'&':
+                        end_field()
+                        name, value = b'', b''
+                        continue
+                    in_value = True
+                    if name == b'fileData':
+                        decoder, percent = DataUriStreamDecoder(), PercentStreamDecoder()
+                    continue
+
+                end = chunk.find(b'&', position)
+                piece = chunk[position:] if end == -1 else chunk[position:end]
+                if decoder is not None:
+                    self.feed_file(decoder, percent.feed(piece))
+                else:
+                    value += piece
+                    if len(value) > MAX_FIELD_SIZE:
+                        raise ValueError("Form field too large")
+                if end == -1:
+                    break
+                end_field()
+                name, value, in_value = b'', b'', False
+                position = end + 1
+
+        if name or in_value:
+            end_field()
+
+        if not self.sink.received:
+            self.send_error(400, "No file data provided")
+            return
+        self.sink.finish()
+
+    def feed_file(self, decoder, data):
+        """Decodes a piece of file data; the MIME type is taken from the data URI header once seen"""
+        decoded = decoder.feed(data)
+        if getattr(decoder, 'mime_type', None) and not self.sink.received:
+            self.sink.mime_type = self.sink.mime_type or decoder.mime_type
+            self.sink.received = True
+        self.sink.write(decoded)
+
+    def start_file_part(self, part, head):
+        """Sniffs the first bytes of a file part: a data URI is decoded, anything else is the file itself"""
+        if head.startswith(b'data:'):
+            part['decoder'] = DataUriStreamDecoder()
+        else:
+            part['decoder'] = _PassThrough()
+            self.sink.mime_type = part['content_type'] or DEFAULT_MIME_TYPE
+            self.sink.received = True
+        self.feed_file(part['decoder'], head)
+
+    def handle_multipart(self, boundary):
+        """
+        multipart/form-data upload. The file part ('fileData', or any part with a filename) may be
+        a raw binary file or a data URI; the 'filename' field or the part's own filename names it.
+        """
+        self.sink = FileSink(self)
+        delimiter = b'\r\n--' + boundary
+        # The first boundary is not preceded by CRLF
+        buffer = b'\r\n'
+        state = 'preamble'
+        part = None
+        chunks = self.read_chunks()
+
+        def fill():
+            nonlocal buffer
+            chunk = next(chunks, None)
+            if chunk is None:
+                return False
+            buffer += chunk
+            return True
+
+        while True:
+            if state in ('preamble', 'body'):
+                index = buffer.find(delimiter)
+                if index == -1:
+                    # Keep enough of the tail to recognise a delimiter split across chunks
+                    keep = len(delimiter) - 1
+                    if state == 'body' and len(buffer) > keep:
+                        self.part_data(part, buffer[:-keep])
+                        buffer = buffer[-keep:]
+                    if not fill():
+                        break
+                    continue
+                if state == 'body':
+                    self.part_data(part, buffer[:index])
+                    self.part_end(part)
+                buffer = buffer[index + len(delimiter):]
+                while len(buffer) < 2 and fill():
+                    pass
+                if buffer.startswith(b'--'):
+                    break
+                state = 'headers'
+            elif state == 'headers':
+                index = buffer.find(b'\r\n\r\n')
+                if index == -1:
+                    if len(buffer) > MAX_FIELD_SIZE or not fill():
+                        raise ValueError("Malformed multipart body")
+                    continue
+                part = self.part_start(buffer[:index].decode('utf-8', 'replace'))
+                buffer = buffer[index + 4:]
+                state = 'body'
+
+        if not self.sink.received:
+            self.send_error(400, "No file data provided")
+            return
+        self.sink.finish()
+
+    def part_start(self, raw_headers):
+        headers = {}
+        for line in raw_headers.split('\r\n'):
+            if ':' in line:
+                key, value = line.split(':', 1)
+                headers[key.strip().lower()] = value.strip()
+        disposition = headers.get('content-disposition', '')
+        name = re.search(r'\bname="([^"]*)"', disposition)
+        filename = re.search(r'\bfilename="([^"]*)"', disposition)
+        part = {
+            'name': name.group(1) if name else '',
+            'filename': filename.group(1) if filename else None,
+            'content_type': headers.get('content-type'),
+            'value': b'',
+            'decoder': None,
+        }
+        part['is_file'] = part['name'] == 'fileData' or part['filename'] is not None
+        if part['is_file'] and part['filename'] and self.sink.filename is None:
+            self.sink.filename = part['filename']
+        return part
+
+    def part_data(self, part, data):
+        if not data:
+            return
+        if not part['is_file']:
+            part['value'] += data
+            if len(part['value']) > MAX_FIELD_SIZE:
+                raise ValueError("Form field too large")
+            return
+        if part['decoder'] is None:
+            part['value'] += data
+            if len(part['value']) < len(b'data:'):
+                return
+            head, part['value'] = part['value'], b''
+            self.start_file_part(part, head)
+            return
+        self.feed_file(part['decoder'], data)
+
+    def part_end(self, part):
+        if not part['is_file']:
+            if part['name'] == 'filename':
+                self.sink.filename = part['value'].decode('utf-8', 'replace')
+            return
+        if part['decoder'] is None:
+            # Files shorter than the sniffing length
+            head, part['value'] = part['value'], b''
+            self.start_file_part(part, head)
+        self.sink.write(part['decoder'].flush())
@@ -1,14 +1,37 @@
 from http.server import BaseHTTPRequestHandler
 import json
+import gzip
+import zlib
+import sqlite3
+import hashlib
+import csv
+import io
+import tempfile
+import html
 import requests
 from bs4 import BeautifulSoup
+from html.parser import HTMLParser
 import os
 import time
 import re
 import random
 import logging
 import urllib3
+import urllib.parse
+import threading
 import concurrent.futures # Import this
+from collections import OrderedDict, deque
+from decimal import Decimal, ROUND_HALF_UP
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, the CGPA engine falls back to plain table lookups
+    np = None
+
+try:
+    from openpyxl import Workbook
+except ImportError:  # openpyxl is optional, without it only CSV exports are available
+    Workbook = None
 
 # Suppress InsecureRequestWarning for requests made with verify=False
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -26,11 +49,1298 @@ USER_AGENTS = [
     'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Edge/120.0.0.0'
 ]
 
+# Result cache settings (seconds / entries)
+RESULT_CACHE_TTL = int(os.environ.get('RESULT_CACHE_TTL', 300))
+RESULT_CACHE_STALE_TTL = int(os.environ.get('RESULT_CACHE_STALE_TTL', 1800))
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get('RESULT_CACHE_MAX_ENTRIES', 5000))
+
+
+class ResultCache:
+    """
+    Bounded in-process cache for scraped results, keyed by (source, registration number).
+    Entries younger than `ttl` are fresh. Entries older than `ttl` but younger than
+    `stale_ttl` are served as stale while a single background refresh runs.
+    The least recently used entry is evicted once `max_entries` is reached.
+    """
+    def __init__(self, max_entries=RESULT_CACHE_MAX_ENTRIES, ttl=RESULT_CACHE_TTL, stale_ttl=RESULT_CACHE_STALE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stale_ttl = max(stale_ttl, ttl)
+        self._entries = OrderedDict()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns (value, age, state) where state is 'fresh', 'stale' or None on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None, 0, None
+            stored_at, value = entry
+            age = time.time() - stored_at
+            if age >= self.stale_ttl:
+                del self._entries[key]
+                return None, 0, None
+            self._entries.move_to_end(key)
+            return value, age, 'fresh' if age < self.ttl else 'stale'
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def begin_refresh(self, key):
+        """Claims the background refresh for a key. Returns False if one is already running."""
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            return True
+
+    def end_refresh(self, key):
+        with self._lock:
+            self._refreshing.discard(key)
+
+
+RESULT_CACHE = ResultCache()
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key into one execution.
+    The first caller runs the function; callers arriving while it is in flight
+    wait for it and receive the same result (or exception).
+    """
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def do(self, key, fn, *args):
+        """Returns (result, shared) where shared is True if another caller's fetch was reused"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                call = {'done': threading.Event(), 'result': None, 'error': None}
+                self._calls[key] = call
+                leader = True
+
+        if not leader:
+            call['done'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['result'], True
+
+        try:
+            call['result'] = fn(*args)
+            return call['result'], False
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call['done'].set()
+
+
+SCRAPE_FLIGHTS = SingleFlight()
+
+# Adaptive timeouts: (upstream, phase) -> (default, min, max) seconds.
+# The default is used until enough samples have been seen.
+TIMEOUT_LIMITS = {
+    ('lms', 'login'): (3, 1, 6),
+    ('lms', 'result'): (10, 3, 20),
+    ('attendance', 'form'): (20, 5, 30),
+    ('attendance', 'submit'): (30, 8, 45),
+    ('health', 'probe'): (4, 1.5, 6),
+}
+LATENCY_WINDOW = int(os.environ.get('LATENCY_WINDOW', 200))
+LATENCY_MIN_SAMPLES = int(os.environ.get('LATENCY_MIN_SAMPLES', 20))
+# Timeout = tail latency * multiplier, clamped to the phase limits
+LATENCY_PERCENTILE = float(os.environ.get('LATENCY_PERCENTILE', 0.99))
+LATENCY_TIMEOUT_MULTIPLIER = float(os.environ.get('LATENCY_TIMEOUT_MULTIPLIER', 1.5))
+
+# Retry budget: every first attempt earns RETRY_BUDGET_RATIO retries, plus a small floor per second
+RETRY_BUDGET_RATIO = float(os.environ.get('RETRY_BUDGET_RATIO', 0.2))
+RETRY_BUDGET_MIN_PER_SECOND = float(os.environ.get('RETRY_BUDGET_MIN_PER_SECOND', 1))
+RETRY_BUDGET_MAX = float(os.environ.get('RETRY_BUDGET_MAX', 20))
+
+
+class LatencyTracker:
+    """
+    Keeps a sliding window of observed latencies per (upstream, phase) and derives
+    timeouts from the tail of that window, within TIMEOUT_LIMITS.
+    Requests that time out are recorded at the timeout they were given, so a slowing
+    upstream pushes its timeout up (to the phase maximum) instead of being cut off forever.
+    """
+    def __init__(self, limits=TIMEOUT_LIMITS, window=LATENCY_WINDOW, min_samples=LATENCY_MIN_SAMPLES):
+        self.limits = limits
+        self.window = window
+        self.min_samples = min_samples
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, upstream, phase, seconds):
+        with self._lock:
+            samples = self._samples.get((upstream, phase))
+            if samples is None:
+                samples = self._samples[(upstream, phase)] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def percentile(self, upstream, phase, q=LATENCY_PERCENTILE):
+        with self._lock:
+            samples = sorted(self._samples.get((upstream, phase), ()))
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def timeout(self, upstream, phase):
+        default, lower, upper = self.limits[(upstream, phase)]
+        tail = self.percentile(upstream, phase)
+        if tail is None:
+            return default
+        return round(min(upper, max(lower, tail * LATENCY_TIMEOUT_MULTIPLIER)), 2)
+
+
+class RetryBudget:
+    """
+    Global retry budget so retries cannot amplify an outage: each first attempt deposits
+    RETRY_BUDGET_RATIO of a retry, each retry withdraws one, and a small per-second floor
+    keeps occasional retries possible when traffic is low.
+    """
+    def __init__(self, ratio=RETRY_BUDGET_RATIO, min_per_second=RETRY_BUDGET_MIN_PER_SECOND, max_balance=RETRY_BUDGET_MAX):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_balance = max_balance
+        self.balance = max_balance
+        self.updated_at = time.monotonic()
+        self.denied = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, amount):
+        now = time.monotonic()
+        self.balance = min(self.max_balance, self.balance + amount + (now - self.updated_at) * self.min_per_second)
+        self.updated_at = now
+
+    def record_request(self):
+        with self._lock:
+            self._refill(self.ratio)
+
+    def can_retry(self):
+        with self._lock:
+            self._refill(0)
+            if self.balance >= 1:
+                self.balance -= 1
+                return True
+            self.denied += 1
+            return False
+
+
+UPSTREAM_LATENCY = LatencyTracker()
+RETRY_BUDGET = RetryBudget()
+
+
+def upstream_call(upstream, phase, fn, *args, **kwargs):
+    """
+    Calls a requests method with an adaptive timeout for (upstream, phase) and records its latency.
+    """
+    timeout = UPSTREAM_LATENCY.timeout(upstream, phase)
+    started = time.monotonic()
+    try:
+        response = fn(*args, timeout=timeout, **kwargs)
+    except requests.exceptions.Timeout:
+        UPSTREAM_LATENCY.record(upstream, phase, timeout)
+        raise
+    UPSTREAM_LATENCY.record(upstream, phase, time.monotonic() - started)
+    return response
+
+
+# Stage latency histogram bucket upper bounds (seconds), up to the longest upstream timeout
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 45)
+
+
+class StageMetrics:
+    """
+    In-process latency histograms per (upstream, stage, outcome), served in Prometheus text
+    format by action=metrics. Like the other module-level state they cover one warm instance.
+    The 'lookup' stage is a whole cached lookup; its counts double as the lookup counters.
+    """
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = buckets
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, upstream, stage, outcome, seconds):
+        with self._lock:
+            histogram = self._histograms.get((upstream, stage, outcome))
+            if histogram is None:
+                histogram = self._histograms[(upstream, stage, outcome)] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram['buckets'][i] += 1
+                    break
+            histogram['sum'] += seconds
+            histogram['count'] += 1
+
+    def snapshot(self):
+        """{(upstream, stage, outcome): {'buckets': [per-bucket counts], 'sum', 'count'}}"""
+        with self._lock:
+            return {key: {'buckets': list(h['buckets']), 'sum': h['sum'], 'count': h['count']} for key, h in self._histograms.items()}
+
+
+STAGE_METRICS = StageMetrics()
+
+
+class RequestTimings:
+    """
+    Stage timings of one request for its Server-Timing header.
+    Batch and combined lookups run a stage on several threads at once, so each stage reports the
+    wall-clock span from its first start to its last end (never longer than the request) and how often it ran.
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._spans = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, name, started, ended):
+        with self._lock:
+            span = self._spans.get(name)
+            if span is None:
+                self._spans[name] = [started, ended, 1]
+            else:
+                span[0] = min(span[0], started)
+                span[1] = max(span[1], ended)
+                span[2] += 1
+
+    def header(self):
+        with self._lock:
+            spans = [(name, ended - started, count) for name, (started, ended, count) in self._spans.items()]
+        entries = [f"{name};dur={seconds * 1000:.1f}" + (f';desc="{count} calls"' if count > 1 else '')
+                   for name, seconds, count in spans]
+        entries.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ', '.join(entries)
+
+
+class StageTimer:
+    """
+    Times one stage of a lookup into STAGE_METRICS and, when given, the request's RequestTimings.
+    The outcome is 'error' if the block raises, otherwise 'ok' unless the block sets another one.
+    """
+    def __init__(self, upstream, stage, timings=None):
+        self.upstream = upstream
+        self.stage = stage
+        self.timings = timings
+        self.outcome = 'ok'
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        ended = time.perf_counter()
+        if exc_type is not None:
+            self.outcome = 'error'
+        STAGE_METRICS.observe(self.upstream, self.stage, self.outcome, ended - self.started)
+        if self.timings is not None:
+            self.timings.add(f"{self.upstream}-{self.stage}", self.started, ended)
+        return False
+
+
+# Persistent result store; set RESULT_STORE_PATH to an empty string to disable it
+RESULT_STORE_PATH = os.environ.get('RESULT_STORE_PATH', '/tmp/uaf-results.sqlite3')
+
+
+class ResultStore:
+    """
+    SQLite store for parsed records, so results survive cold starts and can be served
+    while an upstream is unreachable. Each (source, registration number) keeps the hash of
+    the raw upstream page it was parsed from; an unchanged page skips parsing and rewriting.
+    """
+    def __init__(self, path=RESULT_STORE_PATH):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''CREATE TABLE IF NOT EXISTS pages (
+                source TEXT NOT NULL, registration_number TEXT NOT NULL, page_hash TEXT NOT NULL,
+                fetched_at REAL NOT NULL, PRIMARY KEY (source, registration_number))''')
+            conn.execute('''CREATE TABLE IF NOT EXISTS records (
+                source TEXT NOT NULL, registration_number TEXT NOT NULL, semester TEXT NOT NULL,
+                position INTEGER NOT NULL, data TEXT NOT NULL, PRIMARY KEY (source, registration_number, position))''')
+            conn.execute('CREATE INDEX IF NOT EXISTS records_semester ON records (registration_number, semester)')
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def page_hash(self, source, registration_number):
+        with self._lock:
+            row = self._connect().execute(
+                'SELECT page_hash FROM pages WHERE source = ? AND registration_number = ?',
+                (source, registration_number)).fetchone()
+        return row[0] if row else None
+
+    def touch(self, source, registration_number):
+        with self._lock:
+            conn = self._connect()
+            conn.execute('UPDATE pages SET fetched_at = ? WHERE source = ? AND registration_number = ?',
+                         (time.time(), source, registration_number))
+            conn.commit()
+
+    def save(self, source, registration_number, page_hash, records):
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute('DELETE FROM records WHERE source = ? AND registration_number = ?', (source, registration_number))
+                conn.executemany(
+                    'INSERT INTO records (source, registration_number, semester, position, data) VALUES (?, ?, ?, ?, ?)',
+                    [(source, registration_number, record.get('Semester', ''), i, json.dumps(record)) for i, record in enumerate(records)])
+                conn.execute('INSERT OR REPLACE INTO pages (source, registration_number, page_hash, fetched_at) VALUES (?, ?, ?, ?)',
+                             (source, registration_number, page_hash, time.time()))
+
+    def load(self, source, registration_number, semester=None):
+        """Returns (records, fetched_at) or (None, None) if nothing is stored"""
+        with self._lock:
+            conn = self._connect()
+            page = conn.execute('SELECT fetched_at FROM pages WHERE source = ? AND registration_number = ?',
+                                (source, registration_number)).fetchone()
+            if not page:
+                return None, None
+            query = 'SELECT data FROM records WHERE source = ? AND registration_number = ?'
+            args = [source, registration_number]
+            if semester is not None:
+                query += ' AND semester = ?'
+                args.append(semester)
+            rows = conn.execute(query + ' ORDER BY position', args).fetchall()
+        return [json.loads(row[0]) for row in rows], page[0]
+
+
+RESULT_STORE = ResultStore() if RESULT_STORE_PATH else None
+
+
+# Upstream health / circuit breaker settings
+HEALTH_CACHE_TTL = int(os.environ.get('HEALTH_CACHE_TTL', 30))
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get('BREAKER_FAILURE_THRESHOLD', 5))
+BREAKER_RESET_TIMEOUT = int(os.environ.get('BREAKER_RESET_TIMEOUT', 30))
+
+
+class CircuitBreaker:
+    """
+    Per-upstream circuit breaker.
+    closed: requests flow, consecutive failures are counted.
+    open: requests fail fast until `reset_timeout` has passed.
+    half_open: a single trial request is let through; its outcome closes or re-opens the breaker.
+    """
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0
+        self.trial_started_at = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            now = time.time()
+            if self.state == 'closed':
+                return True
+            if self.state == 'open':
+                if now - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = 'half_open'
+                self.trial_started_at = now
+                logger.info(f"Circuit for {self.name} half-open, letting a trial request through")
+                return True
+            # half_open: one trial at a time; a trial that never reported back is replaced after reset_timeout
+            if now - self.trial_started_at >= self.reset_timeout:
+                self.trial_started_at = now
+                return True
+            return False
+
+    def healthy(self):
+        """True while the last recorded outcome was a success"""
+        return self.state == 'closed' and self.failures == 0
+
+    def record_success(self):
+        with self._lock:
+            if self.state != 'closed':
+                logger.info(f"Circuit for {self.name} closed")
+            self.state = 'closed'
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                if self.state != 'open':
+                    logger.warning(f"Circuit for {self.name} opened after {self.failures} failures")
+                self.state = 'open'
+                self.opened_at = time.time()
+
+
+class HealthMonitor:
+    """
+    Shared upstream health state. Probe results are cached for `ttl` seconds and concurrent
+    probes of the same upstream are coalesced. Probe outcomes also feed the upstream's breaker.
+    """
+    def __init__(self, breakers, ttl=HEALTH_CACHE_TTL):
+        self.breakers = breakers
+        self.ttl = ttl
+        self._status = {}
+        self._flights = SingleFlight()
+        self._lock = threading.Lock()
+
+    def status(self, name, probe):
+        """Returns (status, age) for an upstream, probing it only when the cached result expired"""
+        with self._lock:
+            cached = self._status.get(name)
+        if cached and time.time() - cached[0] < self.ttl:
+            return cached[1], round(time.time() - cached[0], 1)
+
+        status, shared = self._flights.do(name, probe)
+        if shared:
+            # The caller that ran the probe already cached it and fed the breaker
+            return status, 0
+        with self._lock:
+            self._status[name] = (time.time(), status)
+        if status == 'online':
+            self.breakers[name].record_success()
+        else:
+            self.breakers[name].record_failure()
+        return status, 0
+
+
+UPSTREAM_BREAKERS = {'lms': CircuitBreaker('lms'), 'attendance': CircuitBreaker('attendance')}
+UPSTREAM_HEALTH = HealthMonitor(UPSTREAM_BREAKERS)
+
+# Session pool settings
+SESSION_POOL_SIZE = int(os.environ.get('SESSION_POOL_SIZE', 8))
+LMS_TOKEN_TTL = int(os.environ.get('LMS_TOKEN_TTL', 600))
+ATTENDANCE_FORM_TTL = int(os.environ.get('ATTENDANCE_FORM_TTL', 1800))
+
+class TokenBucket:
+    """Thread-safe token bucket; acquire() blocks until a token is available"""
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# Batch scraping limits and per-upstream request rates (requests/second)
+BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE', 500))
+BATCH_DEFAULT_CONCURRENCY = int(os.environ.get('BATCH_DEFAULT_CONCURRENCY', 4))
+BATCH_MAX_CONCURRENCY = int(os.environ.get('BATCH_MAX_CONCURRENCY', 8))
+UPSTREAM_RATE_LIMITS = {
+    'lms': TokenBucket(float(os.environ.get('LMS_RATE_LIMIT', 5)), int(os.environ.get('LMS_RATE_BURST', 5))),
+    'attendance': TokenBucket(float(os.environ.get('ATTENDANCE_RATE_LIMIT', 3)), int(os.environ.get('ATTENDANCE_RATE_BURST', 3))),
+}
+
+# Upstream hosts; overridable so the scraper can be pointed at a local stub (see bench/)
+LMS_HOST = os.environ.get('LMS_HOST', 'lms.uaf.edu.pk')
+ATTENDANCE_BASE_URL = os.environ.get('ATTENDANCE_BASE_URL', 'http://121.52.152.24/')
+
+# Hedged LMS connect: delay before the second scheme is raced against the first
+LMS_HEDGE_DELAY = float(os.environ.get('LMS_HEDGE_DELAY', 0.5))
+# Scheme that answered last; new logins start on it
+LMS_SCHEME_STATE = {'preferred': os.environ.get('LMS_PREFERRED_SCHEME', 'https')}
+LMS_HEDGE_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=16)
+
+ATTENDANCE_PAGE = "default.aspx"
+# Error pages ASP.NET serves when a posted VIEWSTATE/EVENTVALIDATION is no longer accepted
+ATTENDANCE_REJECTION_MARKERS = [
+    'validation of viewstate mac failed',
+    'the state information is invalid',
+    'invalid postback or callback argument',
+    'invalid viewstate',
+]
+
+
+def extract_hidden_input(html_content, input_id):
+    """
+    Pulls the value of a hidden <input id="..."> with a regex instead of building a full soup.
+    Returns None if the input is not present.
+    """
+    tag = re.search(r'<input\b[^>]*\bid\s*=\s*["\']' + re.escape(input_id) + r'["\'][^>]*>', html_content, re.IGNORECASE)
+    if not tag:
+        return None
+    value = re.search(r'\bvalue\s*=\s*(?:"([^"]*)"|\'([^\']*)\')', tag.group(0), re.IGNORECASE)
+    if not value:
+        return ''
+    return html.unescape(value.group(1) if value.group(1) is not None else value.group(2))
+
+
+# Tags BeautifulSoup's html.parser builder treats as self-closing
+VOID_ELEMENTS = {
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen', 'link', 'menuitem', 'meta',
+    'param', 'source', 'track', 'wbr', 'basefont', 'bgsound', 'command', 'frame', 'image', 'isindex',
+    'nextid', 'spacer'
+}
+
+
+class ResultPageParser(HTMLParser):
+    """
+    Single-pass tokenizer that collects only what the result parsers need: the page text
+    and, for every <table>, its rows with their text and <td> texts.
+    Tree semantics follow BeautifulSoup's html.parser builder (end tags close up to the
+    nearest matching open tag, nested tables/rows/cells belong to every ancestor, text
+    inside <script>/<style> is skipped) so both produce the same records.
+    """
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.text = []
+        self.tables = []
+        self._stack = []
+        self._open_tables = []
+        self._open_rows = []
+        self._open_cells = []
+        self._skip_depth = 0
+        self._preserve_depth = 0
+        self._pending = []
+
+    @classmethod
+    def parse(cls, html_content):
+        """Returns (page_text, tables) where tables is [{'id', 'rows': [{'text', 'cells'}]}]"""
+        parser = cls()
+        parser.feed(html_content)
+        parser.close()
+        tables = [
+            {'id': table['id'], 'rows': [{'text': ''.join(row['text']), 'cells': [''.join(cell) for cell in row['cells']]}
+                                         for row in table['rows']]}
+            for table in parser.tables
+        ]
+        return ''.join(parser.text), tables
+
+    def handle_starttag(self, tag, attrs):
+        self._flush()
+        if tag in VOID_ELEMENTS:
+            return
+        item = None
+        if tag == 'table':
+            item = {'id': dict(attrs).get('id'), 'rows': []}
+            self.tables.append(item)
+            self._open_tables.append(item)
+        elif tag == 'tr':
+            item = {'text': [], 'cells': []}
+            for table in self._open_tables:
+                table['rows'].append(item)
+            self._open_rows.append(item)
+        elif tag == 'td':
+            item = []
+            for row in self._open_rows:
+                row['cells'].append(item)
+            self._open_cells.append(item)
+        elif tag in ('script', 'style'):
+            self._skip_depth += 1
+        elif tag in ('pre', 'textarea'):
+            self._preserve_depth += 1
+        self._stack.append(tag)
+
+    def handle_endtag(self, tag):
+        self._flush()
+        if tag not in self._stack:
+            return
+        while self._stack:
+            closed = self._stack.pop()
+            if closed == 'table':
+                self._open_tables.pop()
+            elif closed == 'tr':
+                self._open_rows.pop()
+            elif closed == 'td':
+                self._open_cells.pop()
+            elif closed in ('script', 'style'):
+                self._skip_depth -= 1
+            elif closed in ('pre', 'textarea'):
+                self._preserve_depth -= 1
+            if closed == tag:
+                break
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self._pending.append(data)
+
+    def _flush(self):
+        """Emits the text gathered since the last tag, collapsing whitespace-only runs like BeautifulSoup"""
+        if not self._pending:
+            return
+        data = ''.join(self._pending)
+        self._pending = []
+        if not data.strip(' \n\t\f\r') and not self._preserve_depth:
+            data = '\n' if '\n' in data else ' '
+        self.text.append(data)
+        for row in self._open_rows:
+            row['text'].append(data)
+        for cell in self._open_cells:
+            cell.append(data)
+
+    def handle_comment(self, data):
+        self._flush()
+
+    def handle_decl(self, decl):
+        self._flush()
+
+    def handle_pi(self, data):
+        self._flush()
+
+    def unknown_decl(self, data):
+        self._flush()
+        # BeautifulSoup keeps CDATA sections as text
+        if data.upper().startswith('CDATA['):
+            self.handle_data(data[len('CDATA['):])
+            self._flush()
+
+    def close(self):
+        super().close()
+        self._flush()
+
+
+def soup_tables(html_content):
+    """BeautifulSoup fallback producing the same (page_text, tables) shape as ResultPageParser.parse"""
+    soup = BeautifulSoup(html_content, 'html.parser')
+    tables = [
+        {'id': table.get('id'), 'rows': [{'text': row.get_text(), 'cells': [col.text for col in row.find_all('td')]}
+                                         for row in table.find_all('tr')]}
+        for table in soup.find_all('table')
+    ]
+    return soup.get_text(), tables
+
+
+class LmsSession:
+    """A keep-alive LMS session together with its login token and validity window"""
+    def __init__(self):
+        self.session = requests.Session()
+        self.session.headers.update({'User-Agent': random.choice(USER_AGENTS)})
+        self.base_url = ''
+        self.token = None
+        self.token_expires_at = 0
+
+    def token_valid(self):
+        return self.token is not None and time.time() < self.token_expires_at
+
+    def set_token(self, base_url, token, ttl=LMS_TOKEN_TTL):
+        self.base_url = base_url
+        self.token = token
+        self.token_expires_at = time.time() + ttl
+
+    def invalidate(self):
+        self.token = None
+        self.token_expires_at = 0
+
+
+class AttendanceSession:
+    """A keep-alive Attendance System session with the form state (and cookies) it was issued"""
+    def __init__(self):
+        self.session = requests.Session()
+        self.session.headers.update({'User-Agent': random.choice(USER_AGENTS)})
+        self.viewstate = None
+        self.eventvalidation = None
+        self.token_expires_at = 0
+
+    def token_valid(self):
+        return self.viewstate is not None and time.time() < self.token_expires_at
+
+    def set_form_state(self, viewstate, eventvalidation, ttl=ATTENDANCE_FORM_TTL):
+        self.viewstate = viewstate
+        self.eventvalidation = eventvalidation
+        self.token_expires_at = time.time() + ttl
+
+    def invalidate(self):
+        self.viewstate = None
+        self.eventvalidation = None
+        self.token_expires_at = 0
+        # The cookies belong to the form state we just dropped
+        self.session.cookies.clear()
+
+    def post_registration(self, registration_number):
+        form_data = {
+            '__VIEWSTATE': self.viewstate,
+            '__EVENTVALIDATION': self.eventvalidation,
+            'ctl00$Main$txtReg': registration_number,
+            'ctl00$Main$btnShow': 'Access To Student Information'
+        }
+        return upstream_call('attendance', 'submit', self.session.post, ATTENDANCE_BASE_URL + ATTENDANCE_PAGE, data=form_data)
+
+
+class SessionPool:
+    """
+    Module-level pool of warm upstream sessions. A session is checked out by one request
+    at a time, so its cookies and tokens are never shared between concurrent requests.
+    """
+    def __init__(self, factory, max_idle=SESSION_POOL_SIZE):
+        self.factory = factory
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            # Prefer sessions that already hold a valid token
+            for i in range(len(self._idle) - 1, -1, -1):
+                if self._idle[i].token_valid():
+                    return self._idle.pop(i)
+            if self._idle:
+                return self._idle.pop()
+        return self.factory()
+
+    def release(self, item):
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(item)
+                return
+        item.session.close()
+
+
+LMS_SESSIONS = SessionPool(LmsSession)
+ATTENDANCE_SESSIONS = SessionPool(AttendanceSession)
+
+
+# --- CGPA engine ---
+# Server-side port of the quality point / CGPA rules in public/index.html
+# (calculateQualityPoints, calculateCustomGrade, processSemesterName, getSemesterOrderKey,
+# calculateCGPA). Keep the two in sync: results must match the frontend to the last digit.
+
+# Credit hours -> minimum marks for A/B/C/D (calculateCustomGrade)
+GRADE_THRESHOLDS = {ch: {'A': 16 * ch, 'B': 13 * ch, 'C': 10 * ch, 'D': 8 * ch} for ch in range(1, 11)}
+# Credit hours -> maximum marks of a course
+MAX_MARKS = {ch: 20 * ch for ch in range(1, 11)}
+# Marks at or above the A threshold always give full quality points, so the table stops there
+QP_TABLE_MAX_MARKS = 16 * 10
+
+
+def js_to_fixed(value, places=2):
+    """parseFloat(value.toFixed(places)): rounds the exact binary value, ties away from zero"""
+    return float(Decimal(value).quantize(Decimal(1).scaleb(-places), rounding=ROUND_HALF_UP))
+
+
+def js_parse_float(value):
+    """JS parseFloat on a string: parses the leading number, NaN if there is none"""
+    match = re.match(r'\s*([+-]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][+-]?[0-9]+)?)', str(value))
+    if not match:
+        return float('nan')
+    return float(match.group(1))
+
+
+def quality_points_formula(marks, credit_hours):
+    """Marks-based quality points for one course (the fallback branch of calculateQualityPoints)"""
+    if credit_hours not in GRADE_THRESHOLDS:
+        return 0.0
+    full, pass_mark, fail_mark = 16 * credit_hours, 10 * credit_hours, 8 * credit_hours
+    qp = 0
+    if marks >= full:
+        qp = 4 * credit_hours
+    elif marks >= pass_mark:
+        qp = 4 * credit_hours - ((full - marks) * 0.33333)
+    elif marks < pass_mark:
+        qp = 2 * credit_hours - ((pass_mark - marks) * 0.5)
+    if marks < fail_mark:
+        qp = 0
+    # Math.max(0, NaN) is NaN in JS, which toFixed turns into NaN; the frontend never shows it, we use 0
+    if qp != qp:
+        return 0.0
+    return js_to_fixed(max(0, qp))
+
+
+# QP_TABLE[credit_hours][marks] for whole marks, precomputed once
+QP_TABLE = [[quality_points_formula(marks, ch) for marks in range(QP_TABLE_MAX_MARKS + 1)] for ch in range(11)]
+
+
+def quality_points(marks, credit_hours, grade):
+    """calculateQualityPoints for a single course"""
+    grade = (grade or '').strip().upper()
+    if grade == 'P':
+        return float(credit_hours) * 4.0
+    if grade == 'F':
+        return 0.0
+    if 0 <= credit_hours <= 10 and marks >= 0 and marks == int(marks):
+        return QP_TABLE[credit_hours][min(int(marks), QP_TABLE_MAX_MARKS)]
+    return quality_points_formula(marks, credit_hours)
+
+
+def quality_points_many(marks, credit_hours, grades):
+    """
+    Vectorized calculateQualityPoints over parallel sequences of marks, credit hours and grades.
+    Whole marks are looked up in QP_TABLE (with NumPy fancy indexing when NumPy is installed);
+    fractional or out-of-range marks go through the exact formula.
+    """
+    grades = [(g or '').strip().upper() for g in grades]
+    if np is None or not marks:
+        return [quality_points(m, ch, g) for m, ch, g in zip(marks, credit_hours, grades)]
+
+    marks_arr = np.asarray(marks, dtype=float)
+    ch_arr = np.asarray(credit_hours, dtype=int)
+    grade_arr = np.asarray(grades, dtype=object)
+    table = np.asarray(QP_TABLE)
+
+    in_table = (marks_arr >= 0) & (marks_arr == np.floor(marks_arr)) & (ch_arr >= 0) & (ch_arr <= 10)
+    result = np.zeros(len(marks_arr))
+    rows = ch_arr[in_table]
+    cols = np.minimum(marks_arr[in_table], QP_TABLE_MAX_MARKS).astype(int)
+    result[in_table] = table[rows, cols]
+    for i in np.flatnonzero(~in_table):
+        result[i] = quality_points_formula(marks_arr[i], int(ch_arr[i]))
+
+    result[grade_arr == 'P'] = ch_arr[grade_arr == 'P'] * 4.0
+    result[grade_arr == 'F'] = 0
+    return result.tolist()
+
+
+def custom_grade(marks, credit_hours):
+    """calculateCustomGrade: letter grade from marks for courses without an official grade"""
+    scale = GRADE_THRESHOLDS.get(credit_hours)
+    if not scale:
+        return 'F'
+    for letter in ('A', 'B', 'C', 'D'):
+        if marks >= scale[letter]:
+            return letter
+    return 'F'
+
+
+def process_semester_name(semester):
+    """processSemesterName: normalises LMS/attendance semester names to 'Season YYYY'"""
+    if not semester:
+        return 'Unknown Semester'
+    semester_lower = semester.lower()
+    year_range = re.search(r'([0-9]{4})-([0-9]{2,4})', semester_lower)
+    single_year = re.search(r'\b([0-9]{4})\b', semester_lower, re.ASCII)
+
+    season, year = 'Unknown', ''
+    if 'spring' in semester_lower:
+        season = 'Spring'
+        if year_range:
+            year = year_range.group(2)
+            if len(year) == 2:
+                year = f"20{year}"
+        elif single_year:
+            year = str(int(single_year.group(1)) + 1)
+    else:
+        for name in ('winter', 'summer', 'fall'):
+            if name in semester_lower:
+                season = name.capitalize()
+                if year_range:
+                    year = year_range.group(1)
+                elif single_year:
+                    year = single_year.group(1)
+                break
+
+    if season != 'Unknown' and year:
+        return f"{season} {year}"
+
+    # Attendance style names such as "Winter20"
+    attendance_match = re.match(r'^(winter|spring|summer|fall)([0-9]{2})$', semester_lower)
+    if attendance_match:
+        return f"{attendance_match.group(1).capitalize()} 20{attendance_match.group(2)}"
+
+    return semester[:1].upper() + semester[1:]
+
+
+def semester_order_key(semester_name):
+    """getSemesterOrderKey: 'YYYY-S' sort key of a processed semester name"""
+    if not semester_name:
+        return '9999-9'
+    semester_lower = semester_name.lower()
+    if semester_lower.startswith('forecast'):
+        parts = semester_lower.split(' ')
+        num = parts[1] if len(parts) > 1 and parts[1] else '1'
+        num_match = re.match(r'\s*[+-]?[0-9]+', num)
+        return f"3000-{int(num_match.group(0)) if num_match else 'NaN':0>2}"
+
+    year_match = re.search(r'\b([0-9]{4})\b', semester_lower, re.ASCII)
+    if not year_match:
+        return '9999-9'
+    year = int(year_match.group(1))
+
+    if 'winter' in semester_lower:
+        return f"{year}-1"
+    if 'spring' in semester_lower:
+        return f"{year - 1}-2"
+    if 'summer' in semester_lower:
+        return f"{year - 1}-3"
+    if 'fall' in semester_lower:
+        return f"{year}-4"
+    return f"{year}-9"
+
+
+def normalize_course(record):
+    """
+    Turns a scraped record into the course shape used by the CGPA engine (processScrapedData).
+    Attendance records carry 'Totalmark' and no official credit hours; like the attendance import
+    dialog, they need a CreditHours value and get their grade from the marks.
+    Returns None for records that cannot be counted.
+    """
+    credit_hours_str = str(record.get('CreditHours') or '0')
+    ch_match = re.search(r'[0-9]+', credit_hours_str)
+    credit_hours = int(ch_match.group(0)) if ch_match else 0
+    grade = record.get('Grade') or ''
+
+    if 'Total' not in record and 'Totalmark' in record:
+        if not 0 < credit_hours <= 10:
+            return None
+        marks = js_parse_float(record.get('Totalmark') or '0')
+        grade = custom_grade(marks, credit_hours)
+    else:
+        marks = js_parse_float(record.get('Total') or '0')
+
+    if marks != marks:
+        marks = 0.0
+
+    original_semester = record.get('Semester') or 'Unknown Semester'
+    return {
+        'code': (record.get('CourseCode') or '').strip().upper(),
+        'title': record.get('CourseTitle') or record.get('CourseName') or '',
+        'semester': process_semester_name(original_semester),
+        'originalSemester': original_semester,
+        'creditHours': credit_hours,
+        'marks': marks,
+        'grade': grade,
+        'isDeleted': bool(record.get('isDeleted', False)),
+    }
+
+
+def compute_cgpa(records, quality=None):
+    """
+    calculateCGPA over one student's scraped records.
+    Repeated courses count only their best attempt (highest marks among non-F attempts,
+    later semester on ties), P grades count full quality points with 100 max marks for 1 CH.
+    `quality` optionally supplies precomputed quality points per record (see compute_cgpa_many).
+    """
+    courses = []
+    for i, record in enumerate(records):
+        course = normalize_course(record)
+        if course is None:
+            continue
+        if quality is not None:
+            course['qualityPoints'] = quality[i]
+        courses.append(course)
+    if quality is None:
+        qps = quality_points_many([c['marks'] for c in courses], [c['creditHours'] for c in courses], [c['grade'] for c in courses])
+        for course, qp in zip(courses, qps):
+            course['qualityPoints'] = qp
+
+    semesters = OrderedDict()
+    for course in courses:
+        # Exact 'F' always scores zero, whatever the marks (processScrapedData safeguard)
+        if course['grade'] == 'F':
+            course['qualityPoints'] = 0
+        course['isRepeated'] = False
+        course['isExtraEnrolled'] = False
+        semester = semesters.setdefault(course['semester'], {'name': course['semester'], 'sortKey': semester_order_key(course['semester']), 'courses': []})
+        semester['courses'].append(course)
+
+    # Attempts are collected semester by semester, so ties resolve in the same order as the frontend
+    history = OrderedDict()
+    for semester in semesters.values():
+        for course in semester['courses']:
+            if not course['isDeleted']:
+                history.setdefault(course['code'], []).append((semester['sortKey'], course))
+
+    for attempts in history.values():
+        if len(attempts) < 2:
+            continue
+        attempts.sort(key=lambda attempt: attempt[0])
+        candidates = [c for _, c in attempts if c['grade'] != 'F'] or [c for _, c in attempts]
+        best = candidates[0]
+        for candidate in candidates[1:]:
+            if not best['marks'] > candidate['marks']:
+                best = candidate
+        for _, course in attempts:
+            course['isRepeated'] = True
+            course['isExtraEnrolled'] = course is not best
+
+    totals = {'totalQualityPoints': 0, 'totalCreditHours': 0, 'totalMarksObtained': 0, 'totalMaxMarks': 0}
+    semester_summaries = []
+    for semester in semesters.values():
+        sem_totals = {'totalQualityPoints': 0, 'totalCreditHours': 0, 'totalMarksObtained': 0, 'totalMaxMarks': 0}
+        for course in semester['courses']:
+            if course['isExtraEnrolled'] or course['isDeleted']:
+                continue
+            if course['grade'].strip().upper() == 'P':
+                max_marks = 100 if course['creditHours'] == 1 else course['marks']
+            else:
+                max_marks = MAX_MARKS.get(course['creditHours'], 0)
+            for bucket in (sem_totals, totals):
+                bucket['totalQualityPoints'] += course['qualityPoints']
+                bucket['totalCreditHours'] += course['creditHours']
+                bucket['totalMarksObtained'] += course['marks']
+                bucket['totalMaxMarks'] += max_marks
+        sem_totals['gpa'] = sem_totals['totalQualityPoints'] / sem_totals['totalCreditHours'] if sem_totals['totalCreditHours'] > 0 else 0
+        sem_totals['percentage'] = sem_totals['totalMarksObtained'] / sem_totals['totalMaxMarks'] * 100 if sem_totals['totalMaxMarks'] > 0 else 0
+        semester_summaries.append(dict(name=semester['name'], sortKey=semester['sortKey'], courses=semester['courses'], **sem_totals))
+
+    semester_summaries.sort(key=lambda s: s['sortKey'])
+    totals['cgpa'] = totals['totalQualityPoints'] / totals['totalCreditHours'] if totals['totalCreditHours'] > 0 else 0
+    totals['percentage'] = totals['totalMarksObtained'] / totals['totalMaxMarks'] * 100 if totals['totalMaxMarks'] > 0 else 0
+    totals['semesters'] = semester_summaries
+    return totals
+
+
+def compute_cgpa_many(students):
+    """
+    compute_cgpa for many students, evaluating the quality points of every course of every
+    student in one vectorized pass. `students` is a list of record lists.
+    """
+    flat = []
+    owners = []
+    for index, records in enumerate(students):
+        for position, record in enumerate(records):
+            course = normalize_course(record)
+            if course is not None:
+                flat.append(course)
+                owners.append((index, position))
+    qps = quality_points_many([c['marks'] for c in flat], [c['creditHours'] for c in flat], [c['grade'] for c in flat])
+
+    per_student = [dict() for _ in students]
+    for (index, position), qp in zip(owners, qps):
+        per_student[index][position] = qp
+    return [compute_cgpa(records, quality=per_student[i]) for i, records in enumerate(students)]
+
+
+def merge_source_results(lms_records, attendance_records):
+    """
+    Merges LMS and Attendance System records, de-duplicating by (course code, normalised semester).
+    LMS records win because they carry credit hours; attendance-only courses are appended.
+    """
+    merged = OrderedDict()
+    for source, records in (('lms', lms_records), ('attendance', attendance_records)):
+        for record in records or []:
+            key = ((record.get('CourseCode') or '').strip().upper(), process_semester_name(record.get('Semester')))
+            existing = merged.get(key)
+            if existing is None:
+                merged[key] = dict(record, Source=source, Sources=[source])
+            elif source not in existing['Sources']:
+                existing['Sources'].append(source)
+    return list(merged.values())
+
+
+# Export columns. CSV uses all of them in one table, with Type telling course, semester and summary rows apart;
+# XLSX splits the same rows into one sheet per semester plus the semester GPA and CGPA summary sheets.
+EXPORT_COLUMNS = ['Type', 'Registration No', 'Student Name', 'Semester', 'Course Code', 'Course Title',
+                  'Credit Hours', 'Marks', 'Grade', 'Quality Points', 'GPA', 'Percentage', 'Status']
+EXPORT_COURSE_COLUMNS = ['Registration No', 'Student Name', 'Course Code', 'Course Title',
+                         'Credit Hours', 'Marks', 'Grade', 'Quality Points', 'Status']
+EXPORT_SEMESTER_COLUMNS = ['Registration No', 'Student Name', 'Semester', 'Credit Hours', 'Quality Points', 'GPA', 'Percentage']
+EXPORT_SUMMARY_COLUMNS = ['Registration No', 'Student Name', 'Credit Hours', 'Quality Points', 'GPA', 'Percentage', 'Status']
+EXPORT_SUMMARY_SHEET = 'CGPA Summary'
+EXPORT_SEMESTER_SHEET = 'Semester GPA'
+# Read size when streaming a finished XLSX workbook
+EXPORT_CHUNK_SIZE = 64 * 1024
+# Characters Excel does not allow in sheet titles, which are also capped at 31 characters
+SHEET_TITLE_INVALID = re.compile(r'[\\/*?:\[\]]')
+
+
+def export_student_rows(registration_number, records, success=True, message=''):
+    """
+    Runs compute_cgpa over one student's records and yields export rows (dicts keyed by EXPORT_COLUMNS):
+    the student's courses semester by semester, one GPA row per semester and a closing CGPA row.
+    Students without results, or whose records have no credit hours, only get the summary row with the reason as Status.
+    """
+    records = records or []
+    student_name = next((r.get('StudentName') for r in records if r.get('StudentName')), '')
+    student = {'Registration No': registration_number, 'Student Name': student_name}
+    if not success or not records:
+        yield dict(student, Type='summary', Status=message or 'No results')
+        return
+
+    result = compute_cgpa(records)
+    if not result['semesters']:
+        # e.g. attendance records, which carry no credit hours
+        yield dict(student, Type='summary', Status=message or 'No courses with credit hours')
+        return
+    for semester in result['semesters']:
+        for course in semester['courses']:
+            if course['isDeleted']:
+                status = 'Deleted'
+            elif course['isExtraEnrolled']:
+                status = 'Extra enrolled'
+            elif course['isRepeated']:
+                status = 'Repeated'
+            else:
+                status = ''
+            yield dict(student, Type='course', Semester=semester['name'], **{
+                'Course Code': course['code'], 'Course Title': course['title'], 'Credit Hours': course['creditHours'],
+                'Marks': course['marks'], 'Grade': course['grade'], 'Quality Points': js_to_fixed(course['qualityPoints']),
+                'Status': status})
+        yield dict(student, Type='semester', Semester=semester['name'], **{
+            'Credit Hours': semester['totalCreditHours'], 'Quality Points': js_to_fixed(semester['totalQualityPoints']),
+            'GPA': js_to_fixed(semester['gpa']), 'Percentage': js_to_fixed(semester['percentage'])})
+    yield dict(student, Type='summary', Status=message, **{
+        'Credit Hours': result['totalCreditHours'], 'Quality Points': js_to_fixed(result['totalQualityPoints']),
+        'GPA': js_to_fixed(result['cgpa']), 'Percentage': js_to_fixed(result['percentage'])})
+
+
+def sheet_title(name):
+    """Turns a semester name into a valid worksheet title"""
+    return SHEET_TITLE_INVALID.sub('-', name).strip()[:31] or 'Unknown Semester'
+
+
+def write_csv_export(students, write):
+    """
+    Writes students as CSV through write(bytes), one student at a time, so only the
+    student being written is held in memory. `students` yields (registration_number, records, success, message).
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for registration_number, records, success, message in students:
+        for row in export_student_rows(registration_number, records, success, message):
+            writer.writerow([row.get(column, '') for column in EXPORT_COLUMNS])
+        write(buffer.getvalue().encode('utf-8'))
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        write(buffer.getvalue().encode('utf-8'))
+
+
+def write_xlsx_export(students, fileobj):
+    """
+    Writes students to a write-only openpyxl workbook saved into fileobj.
+    Write-only worksheets spool their rows to temporary files as they are appended,
+    so the workbook is never held in memory; semester sheets come after the summaries, oldest first.
+    """
+    workbook = Workbook(write_only=True)
+    summary_sheet = workbook.create_sheet(EXPORT_SUMMARY_SHEET)
+    summary_sheet.append(EXPORT_SUMMARY_COLUMNS)
+    semester_sheet = workbook.create_sheet(EXPORT_SEMESTER_SHEET)
+    semester_sheet.append(EXPORT_SEMESTER_COLUMNS)
+    course_sheets = {}
+
+    for registration_number, records, success, message in students:
+        for row in export_student_rows(registration_number, records, success, message):
+            if row['Type'] == 'course':
+                title = sheet_title(row['Semester'])
+                sheet = course_sheets.get(title)
+                if sheet is None:
+                    sheet = course_sheets[title] = workbook.create_sheet(title)
+                    sheet.append(EXPORT_COURSE_COLUMNS)
+                sheet.append([row.get(column) for column in EXPORT_COURSE_COLUMNS])
+            elif row['Type'] == 'semester':
+                semester_sheet.append([row.get(column) for column in EXPORT_SEMESTER_COLUMNS])
+            else:
+                summary_sheet.append([row.get(column) for column in EXPORT_SUMMARY_COLUMNS])
+
+    for index, title in enumerate(sorted(course_sheets, key=semester_order_key), start=2):
+        # move_sheet only takes write-only sheets by title
+        workbook.move_sheet(title, index - workbook.index(course_sheets[title]))
+    workbook.save(fileobj)
+
+
+# Response encoding
+COMPRESS_MIN_BYTES = 512
+# Record lists sent as {'fields': [...], 'rows': [[...]]} with format=compact
+COMPACT_KEYS = ('resultData', 'courses')
+# Per-request bookkeeping that must not change the ETag of otherwise identical results
+ETAG_IGNORED_KEYS = {'cacheHit', 'cacheAge', 'statusAge'}
+
+
+def compact_records(records):
+    """[{...}, ...] -> {'fields': [...], 'rows': [[...], ...]}; fields keep first-seen order"""
+    fields = list(OrderedDict.fromkeys(key for record in records for key in record))
+    return {'fields': fields, 'rows': [[record.get(field) for field in fields] for record in records]}
+
+
+def compact_results(data):
+    """Recursively rewrites the record lists under COMPACT_KEYS into the columnar form"""
+    if isinstance(data, dict):
+        compacted = {}
+        for key, value in data.items():
+            if key in COMPACT_KEYS and isinstance(value, list) and all(isinstance(item, dict) for item in value):
+                compacted[key] = compact_records([compact_results(item) for item in value])
+            else:
+                compacted[key] = compact_results(value)
+        return compacted
+    if isinstance(data, list):
+        return [compact_results(item) for item in data]
+    return data
+
+
+def _without_volatile_keys(data):
+    if isinstance(data, dict):
+        return {key: _without_volatile_keys(value) for key, value in data.items() if key not in ETAG_IGNORED_KEYS}
+    if isinstance(data, list):
+        return [_without_volatile_keys(item) for item in data]
+    return data
+
+
+def result_etag(data, compact=False):
+    """Weak ETag over the result content, ignoring per-request fields such as cache age"""
+    content = json.dumps(_without_volatile_keys(data), sort_keys=True, separators=(',', ':'))
+    digest = hashlib.sha1(content.encode()).hexdigest()[:20]
+    return f'W/"{"c" if compact else "j"}{digest}"'
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(',')]
+    # Weak comparison: W/"x" and "x" match
+    return '*' in candidates or etag.removeprefix('W/') in [candidate.removeprefix('W/') for candidate in candidates]
+
+
+def negotiate_encoding(accept_encoding):
+    """Picks gzip or deflate from an Accept-Encoding header (honouring q=0), or None"""
+    accepted = {}
+    for part in (accept_encoding or '').split(','):
+        pieces = part.strip().split(';')
+        name = pieces[0].strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in pieces[1:]:
+            param = param.strip()
+            if param.startswith('q='):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        accepted[name] = quality
+    for encoding in ('gzip', 'deflate'):
+        if accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+
+class DiscardedBody:
+    """Stands in for wfile once a HEAD response's headers are out, so handlers can write the body as for GET"""
+    def write(self, data):
+        return len(data)
+
+    def flush(self):
+        pass
+
+
 class handler(BaseHTTPRequestHandler):
     def _set_cors_headers(self):
         self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS, DELETE')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Access-Control-Allow-Methods', 'GET, HEAD, POST, OPTIONS, DELETE')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, If-None-Match')
+        self.send_header('Access-Control-Expose-Headers', 'ETag, Server-Timing')
+        self.send_header('Timing-Allow-Origin', '*')
     
     def do_OPTIONS(self):
         self.send_response(200)
@@ -39,13 +1349,22 @@ class handler(BaseHTTPRequestHandler):
         return
 
     def do_GET(self):
+        self.timings = RequestTimings()
         try:
-            if 'action=scrape_single' in self.path:
+            if 'action=scrape_batch' in self.path:
+                self.handle_scrape_batch()
+            elif 'action=scrape_single' in self.path:
                 self.handle_scrape_single()
             elif 'action=scrape_attendance' in self.path:
                 self.handle_scrape_attendance()
+            elif 'action=scrape_all' in self.path:
+                self.handle_scrape_all()
             elif 'action=check_status' in self.path:
                 self.handle_check_status()
+            elif 'action=export' in self.path:
+                self.handle_export()
+            elif 'action=metrics' in self.path:
+                self.handle_metrics()
             else:
                 self.send_response(404)
                 self._set_cors_headers()
@@ -53,12 +1372,29 @@ class handler(BaseHTTPRequestHandler):
         except Exception as e:
             self.send_error_response(500, f"Server error: {str(e)}")
 
+    def do_HEAD(self):
+        """Routed like GET; the body is produced as for GET but dropped after the headers"""
+        wfile = self.wfile
+        try:
+            self.do_GET()
+        finally:
+            self.wfile = wfile
+
     def do_POST(self):
+        self.timings = RequestTimings()
         try:
-            if 'action=scrape_single' in self.path:
+            if 'action=scrape_batch' in self.path:
+                self.handle_scrape_batch()
+            elif 'action=scrape_single' in self.path:
                 self.handle_scrape_single()
             elif 'action=scrape_attendance' in self.path:
                 self.handle_scrape_attendance()
+            elif 'action=scrape_all' in self.path:
+                self.handle_scrape_all()
+            elif 'action=compute_cgpa' in self.path:
+                self.handle_compute_cgpa()
+            elif 'action=export' in self.path:
+                self.handle_export()
             else:
                 self.send_response(404)
                 self._set_cors_headers()
@@ -66,6 +1402,20 @@ class handler(BaseHTTPRequestHandler):
         except Exception as e:
             self.send_error_response(500, f"Server error: {str(e)}")
 
+    def end_headers(self):
+        # Every response reports the stages timed so far; streamed responses only see what ran before their headers
+        timings = getattr(self, 'timings', None)
+        if timings is not None:
+            self.send_header('Server-Timing', timings.header())
+        super().end_headers()
+        if self.command == 'HEAD':
+            self.wfile.flush()
+            self.wfile = DiscardedBody()
+
+    def stage(self, upstream, stage):
+        """StageTimer for one stage of this request's lookups"""
+        return StageTimer(upstream, stage, getattr(self, 'timings', None))
+
     def send_error_response(self, status_code, message):
         self.send_response(status_code)
         self._set_cors_headers()
@@ -75,20 +1425,139 @@ class handler(BaseHTTPRequestHandler):
         self.wfile.write(json.dumps(response).encode())
 
     def send_success_response(self, data):
+        """
+        Sends a JSON response. Supports format=compact (field names once, rows as arrays),
+        gzip/deflate negotiated from Accept-Encoding, and a weak ETag over the result content
+        so a matching If-None-Match on a GET/HEAD gets a 304 without a body (POST actions always get the full response).
+        """
+        compact = self.response_format() == 'compact'
+        if compact:
+            data = compact_results(data)
+
+        etag = result_etag(data, compact)
+        if self.command in ('GET', 'HEAD') and etag_matches(self.headers.get('If-None-Match'), etag):
+            self.send_response(304)
+            self._set_cors_headers()
+            self.send_header('ETag', etag)
+            self.send_header('Vary', 'Accept-Encoding')
+            self.end_headers()
+            return
+
+        body = json.dumps(data).encode()
+        encoding = negotiate_encoding(self.headers.get('Accept-Encoding')) if len(body) >= COMPRESS_MIN_BYTES else None
+        if encoding == 'gzip':
+            body = gzip.compress(body, compresslevel=6)
+        elif encoding == 'deflate':
+            body = zlib.compress(body, 6)
+
         self.send_response(200)
         self._set_cors_headers()
         self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Vary', 'Accept-Encoding')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def response_format(self):
+        """'compact' when requested via the query string or the JSON body, otherwise None"""
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+        if 'format' in query:
+            return query['format'][-1]
+        return getattr(self, 'request_params', {}).get('format')
+
+    def wants_stream(self, params):
+        """
+        Streaming is opt-in via stream=1 (in the query string or, as for format, the JSON body)
+        or an Accept: application/x-ndjson header
+        """
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+        stream = query['stream'][-1] if 'stream' in query else params.get('stream', '')
+        if str(stream).lower() in ('1', 'true', 'yes'):
+            return True
+        return 'application/x-ndjson' in (self.headers.get('Accept') or '')
+
+    def start_stream(self, content_type='application/x-ndjson', filename=None):
+        """
+        Starts a streamed response (newline-delimited JSON unless another content type is given).
+        Chunked transfer encoding needs HTTP/1.1, so it is only used for HTTP/1.1 clients;
+        HTTP/1.0 clients get the same records delimited by connection close.
+        """
+        self.stream_chunked = self.request_version == 'HTTP/1.1'
+        if self.stream_chunked:
+            self.protocol_version = 'HTTP/1.1'
+        self.send_response(200)
+        self._set_cors_headers()
+        self.send_header('Content-Type', content_type)
+        self.send_header('Cache-Control', 'no-cache')
+        if filename:
+            self.send_header('Content-Disposition', f'attachment; filename="{filename}"')
+        if self.stream_chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('Connection', 'close')
         self.end_headers()
-        self.wfile.write(json.dumps(data).encode())
+        self.close_connection = True
+
+    def send_stream_record(self, record):
+        self.send_stream_chunk((json.dumps(record) + '\n').encode())
+
+    def send_stream_chunk(self, data):
+        if not data:
+            return
+        if self.stream_chunked:
+            self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+        else:
+            self.wfile.write(data)
+        self.wfile.flush()
+
+    def end_stream(self):
+        if self.stream_chunked:
+            self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def send_semester_stream(self, response):
+        """Streams a single lookup as one record per semester followed by a summary record"""
+        self.start_stream()
+        semesters = OrderedDict()
+        for course in response['resultData'] or []:
+            semesters.setdefault(course.get('Semester', ''), []).append(course)
+        for semester, courses in semesters.items():
+            self.send_stream_record({'type': 'semester', 'semester': semester, 'resultData': courses})
+        summary = {key: value for key, value in response.items() if key != 'resultData'}
+        summary['type'] = 'summary'
+        self.send_stream_record(summary)
+        self.end_stream()
+
+    def send_batch_stream(self, registration_numbers, sources, concurrency):
+        """Streams a batch as one record per student, in completion order, followed by a summary record"""
+        self.start_stream()
+        succeeded = failed = 0
+        for record in self.iter_batch(registration_numbers, sources, concurrency):
+            if record['success']:
+                succeeded += 1
+            else:
+                failed += 1
+            record['type'] = 'student'
+            self.send_stream_record(record)
+        self.send_stream_record({'type': 'summary', 'success': True,
+                                 'message': f"Fetched {succeeded} of {succeeded + failed} students",
+                                 'succeeded': succeeded, 'failed': failed})
+        self.end_stream()
 
     # --- MODIFIED FUNCTION ---
-    def check_server_health(self, url, method='get', timeout=4): # <-- Reduced timeout to 4
+    def check_server_health(self, url, method='get', timeout=None):
         """
         Checks a single URL.
         Returns 'online' for 200-399 status.
         Returns 'error' for 500-599 status.
         Returns 'offline' for connection errors or timeouts.
+        Uses the adaptive health probe timeout unless one is given.
         """
+        if timeout is None:
+            timeout = UPSTREAM_LATENCY.timeout('health', 'probe')
+        started = time.monotonic()
         try:
             with requests.Session() as s:
                 s.headers.update({'User-Agent': random.choice(USER_AGENTS)})
@@ -96,7 +1565,8 @@ class handler(BaseHTTPRequestHandler):
                     resp = s.head(url, timeout=timeout, verify=False, allow_redirects=True)
                 else:
                     resp = s.get(url, timeout=timeout, verify=False, allow_redirects=True)
-            
+            UPSTREAM_LATENCY.record('health', 'probe', time.monotonic() - started)
+
             if 200 <= resp.status_code < 400:
                 return 'online' # Includes 200-OK, 301/302-Redirects
             elif 500 <= resp.status_code < 600:
@@ -105,8 +1575,10 @@ class handler(BaseHTTPRequestHandler):
                 return 'offline' # Other client errors (404, 403)
         except requests.exceptions.RequestException as e:
             logger.warning(f"Health check for {url} failed: {str(e)}")
+            if isinstance(e, requests.exceptions.Timeout):
+                UPSTREAM_LATENCY.record('health', 'probe', timeout)
             # Try GET if HEAD failed, as some servers block HEAD
-            if method == 'head':
+            if method == 'head' and RETRY_BUDGET.can_retry():
                 logger.info(f"Retrying {url} with GET...")
                 # Call with 'get' but use the *same* short timeout
                 return self.check_server_health(url, method='get', timeout=timeout)
@@ -117,53 +1589,107 @@ class handler(BaseHTTPRequestHandler):
         """
         Handles the 'check_status' action by checking LMS and Attendance servers.
         """
-        lms_status = 'offline'
-        attnd_status = 'offline'
-
         with concurrent.futures.ThreadPoolExecutor() as executor:
-            # Use 'head' for LMS (fast)
-            future_lms_http = executor.submit(self.check_server_health, 'http://lms.uaf.edu.pk/login/index.php', method='head')
-            future_lms_https = executor.submit(self.check_server_health, 'https://lms.uaf.edu.pk/login/index.php', method='head')
-            # Use 'get' for Attendance (to catch the 500 error faster)
-            future_attnd = executor.submit(self.check_server_health, 'http://121.52.152.24/default.aspx', method='get')
-
-            # Process LMS results
-            if future_lms_http.result() == 'online' or future_lms_https.result() == 'online':
-                lms_status = 'online'
-            
-            # Process Attendance result
-            attnd_status = future_attnd.result()
+            future_lms = executor.submit(UPSTREAM_HEALTH.status, 'lms', self.probe_lms)
+            future_attnd = executor.submit(UPSTREAM_HEALTH.status, 'attendance', self.probe_attendance)
+            lms_status, lms_age = future_lms.result()
+            attnd_status, attnd_age = future_attnd.result()
 
         response_data = {
             'success': True,
             'lms_status': lms_status,
-            'attnd_status': attnd_status
+            'attnd_status': attnd_status,
+            'lms_circuit': UPSTREAM_BREAKERS['lms'].state,
+            'attnd_circuit': UPSTREAM_BREAKERS['attendance'].state,
+            'statusAge': max(lms_age, attnd_age),
+            'coalescedRequests': SCRAPE_FLIGHTS.coalesced
         }
         self.send_success_response(response_data)
 
+    def handle_metrics(self):
+        """Stage latency histograms, lookup counters and resilience state in Prometheus text format"""
+        lines = ['# HELP uaf_stage_duration_seconds Time spent in each stage of an upstream lookup.',
+                 '# TYPE uaf_stage_duration_seconds histogram']
+        histograms = STAGE_METRICS.snapshot()
+        for (upstream, stage, outcome), histogram in sorted(histograms.items()):
+            labels = f'upstream="{upstream}",stage="{stage}",outcome="{outcome}"'
+            cumulative = 0
+            for bound, count in zip(STAGE_METRICS.buckets, histogram['buckets']):
+                cumulative += count
+                lines.append(f'uaf_stage_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'uaf_stage_duration_seconds_bucket{{{labels},le="+Inf"}} {histogram["count"]}')
+            lines.append(f'uaf_stage_duration_seconds_sum{{{labels}}} {histogram["sum"]:.6f}')
+            lines.append(f'uaf_stage_duration_seconds_count{{{labels}}} {histogram["count"]}')
+
+        lines += ['# HELP uaf_lookups_total Result lookups by upstream and outcome.', '# TYPE uaf_lookups_total counter']
+        for (upstream, stage, outcome), histogram in sorted(histograms.items()):
+            if stage == 'lookup':
+                lines.append(f'uaf_lookups_total{{upstream="{upstream}",outcome="{outcome}"}} {histogram["count"]}')
+
+        lines += ['# HELP uaf_coalesced_requests_total Lookups that joined an identical in-flight scrape.',
+                  '# TYPE uaf_coalesced_requests_total counter',
+                  f'uaf_coalesced_requests_total {SCRAPE_FLIGHTS.coalesced}',
+                  '# HELP uaf_retry_budget_denied_total Retries and hedges refused by the retry budget.',
+                  '# TYPE uaf_retry_budget_denied_total counter',
+                  f'uaf_retry_budget_denied_total {RETRY_BUDGET.denied}',
+                  '# HELP uaf_retry_budget_balance Retries currently available.',
+                  '# TYPE uaf_retry_budget_balance gauge',
+                  f'uaf_retry_budget_balance {RETRY_BUDGET.balance:.3f}',
+                  '# HELP uaf_circuit_breaker_state 1 for the current state of each upstream circuit breaker.',
+                  '# TYPE uaf_circuit_breaker_state gauge']
+        for name, breaker in UPSTREAM_BREAKERS.items():
+            for state in ('closed', 'open', 'half_open'):
+                lines.append(f'uaf_circuit_breaker_state{{upstream="{name}",state="{state}"}} {int(breaker.state == state)}')
+        lines += ['# HELP uaf_circuit_breaker_failures Consecutive failures counted by each circuit breaker.',
+                  '# TYPE uaf_circuit_breaker_failures gauge']
+        lines += [f'uaf_circuit_breaker_failures{{upstream="{name}"}} {breaker.failures}' for name, breaker in UPSTREAM_BREAKERS.items()]
+        lines += ['# HELP uaf_upstream_timeout_seconds Current adaptive timeout per upstream phase.',
+                  '# TYPE uaf_upstream_timeout_seconds gauge']
+        lines += [f'uaf_upstream_timeout_seconds{{upstream="{upstream}",phase="{phase}"}} {UPSTREAM_LATENCY.timeout(upstream, phase)}'
+                  for upstream, phase in TIMEOUT_LIMITS]
+        lines += ['# HELP uaf_result_cache_entries Entries in the in-process result cache.',
+                  '# TYPE uaf_result_cache_entries gauge',
+                  f'uaf_result_cache_entries {len(RESULT_CACHE)}']
+
+        body = ('\n'.join(lines) + '\n').encode()
+        self.send_response(200)
+        self._set_cors_headers()
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def probe_lms(self):
+        """Probes the LMS login page over both schemes; online if either answers"""
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            # Use 'head' for LMS (fast)
+            future_lms_http = executor.submit(self.check_server_health, f'http://{LMS_HOST}/login/index.php', method='head')
+            future_lms_https = executor.submit(self.check_server_health, f'https://{LMS_HOST}/login/index.php', method='head')
+            if future_lms_http.result() == 'online' or future_lms_https.result() == 'online':
+                return 'online'
+        return 'offline'
+
+    def probe_attendance(self):
+        # Use 'get' for Attendance (to catch the 500 error faster)
+        return self.check_server_health(ATTENDANCE_BASE_URL + ATTENDANCE_PAGE, method='get')
+
     def handle_scrape_single(self):
         """Handle single result scraping for CGPA calculator"""
         try:
-            if self.command == 'GET':
-                query_params = self.path.split('?')
-                if len(query_params) > 1:
-                    params = dict(param.split('=') for param in query_params[1].split('&'))
-                    registration_number = params.get('registrationNumber')
-                else:
-                    self.send_error_response(400, 'No registration number provided')
-                    return
-            else: # POST
-                content_length = int(self.headers['Content-Length'])
-                post_data = self.rfile.read(content_length)
-                data = json.loads(post_data)
-                registration_number = data.get('registrationNumber')
+            params = self.read_params()
+            registration_number = self.registration_number_param(params)
             
             if not registration_number:
                 self.send_error_response(400, 'No registration number provided')
                 return
             
-            success, message, result_data = self.scrape_uaf_results(registration_number)
-            response = {'success': success, 'message': message, 'resultData': result_data}
+            success, message, result_data, cache_hit, cache_age = self.fetch_cached('lms', registration_number, self.scrape_uaf_results)
+            response = {'success': success, 'message': message, 'resultData': result_data,
+                        'cacheHit': cache_hit, 'cacheAge': cache_age}
+            if self.wants_stream(params):
+                self.send_semester_stream(response)
+                return
             self.send_success_response(response)
         except Exception as e:
             self.send_error_response(500, f"Error scraping single result: {str(e)}")
@@ -171,140 +1697,590 @@ class handler(BaseHTTPRequestHandler):
     def handle_scrape_attendance(self):
         """Handle result scraping from the Attendance System"""
         try:
-            if self.command == 'GET':
-                query_params = self.path.split('?')
-                if len(query_params) > 1:
-                    params = dict(param.split('=') for param in query_params[1].split('&'))
-                    registration_number = params.get('registrationNumber')
-                else:
-                    self.send_error_response(400, 'No registration number provided')
-                    return
-            else: # POST
-                content_length = int(self.headers['Content-Length'])
-                post_data = self.rfile.read(content_length)
-                data = json.loads(post_data)
-                registration_number = data.get('registrationNumber')
+            params = self.read_params()
+            registration_number = self.registration_number_param(params)
             
             if not registration_number:
                 self.send_error_response(400, 'No registration number provided')
                 return
 
-            success, message, result_data = self.scrape_attendance_system(registration_number)
-            response = {'success': success, 'message': message, 'resultData': result_data}
+            success, message, result_data, cache_hit, cache_age = self.fetch_cached('attendance', registration_number, self.scrape_attendance_system)
+            response = {'success': success, 'message': message, 'resultData': result_data,
+                        'cacheHit': cache_hit, 'cacheAge': cache_age}
+            if self.wants_stream(params):
+                self.send_semester_stream(response)
+                return
             self.send_success_response(response)
         except Exception as e:
             self.send_error_response(500, f"Error scraping attendance system: {str(e)}")
 
-    def scrape_attendance_system(self, registration_number):
-        """Scrapes results from the UAF Attendance System"""
-        BASE_URL = "http://121.52.152.24/"
-        DEFAULT_PAGE = "default.aspx"
-        
+    def registration_number_param(self, params):
+        """registrationNumber as a string; JSON bodies may send it as a number, anything else counts as missing"""
+        registration_number = params.get('registrationNumber')
+        if isinstance(registration_number, int) and not isinstance(registration_number, bool):
+            return str(registration_number)
+        return registration_number if isinstance(registration_number, str) else None
+
+    def read_params(self):
+        """Reads request parameters from the query string (GET/HEAD) or the JSON body (POST)"""
+        if self.command in ('GET', 'HEAD'):
+            query = urllib.parse.urlsplit(self.path).query
+            self.request_params = {key: values[-1] for key, values in urllib.parse.parse_qs(query).items()}
+            return self.request_params
+        content_length = int(self.headers.get('Content-Length') or 0)
+        self.request_params = json.loads(self.rfile.read(content_length)) if content_length else {}
+        return self.request_params
+
+    def scrape_sources(self):
+        """Upstream name -> scrape function, shared by the single, batch and combined lookups"""
+        return {'lms': self.scrape_uaf_results, 'attendance': self.scrape_attendance_system}
+
+    def rate_limited(self, source, fetch):
+        """Wraps a scrape function so every real upstream call takes a token from that upstream's bucket"""
+        limiter = UPSTREAM_RATE_LIMITS[source]
+        def limited(registration_number):
+            limiter.acquire()
+            return fetch(registration_number)
+        return limited
+
+    def handle_scrape_batch(self):
+        """
+        Handle batch scraping for a list of registration numbers.
+        Params: registrationNumbers (list, or comma separated for GET), source ('lms', 'attendance'
+        or 'both', default 'lms') and concurrency (worker count, capped at BATCH_MAX_CONCURRENCY).
+        """
+        try:
+            params = self.read_params()
+            try:
+                registration_numbers, sources, concurrency = self.batch_params(params)
+            except ValueError as e:
+                self.send_error_response(400, str(e))
+                return
+
+            if self.wants_stream(params):
+                self.send_batch_stream(registration_numbers, sources, concurrency)
+                return
+
+            results = self.run_batch(registration_numbers, sources, concurrency)
+            succeeded = sum(1 for r in results if r['success'])
+            self.send_success_response({
+                'success': True,
+                'message': f"Fetched {succeeded} of {len(results)} students",
+                'succeeded': succeeded,
+                'failed': len(results) - succeeded,
+                'results': results
+            })
+        except Exception as e:
+            self.send_error_response(500, f"Error scraping batch: {str(e)}")
+
+    def batch_params(self, params, needs_credit_hours=False):
+        """
+        Validates the batch parameters shared by scrape_batch and export.
+        Returns (registration_numbers, sources, concurrency); raises ValueError with a client-facing message.
+        needs_credit_hours rejects source=attendance, whose records carry no credit hours to compute GPA from.
+        """
+        registration_numbers = params.get('registrationNumbers') or []
+        if isinstance(registration_numbers, str):
+            registration_numbers = registration_numbers.split(',')
+        if not isinstance(registration_numbers, list) or not all(r is None or isinstance(r, (str, int)) and not isinstance(r, bool) for r in registration_numbers):
+            raise ValueError('registrationNumbers must be a list of strings or a comma separated string')
+        # De-duplicate while keeping the caller's order
+        registration_numbers = list(dict.fromkeys(str(r).strip() for r in registration_numbers if r is not None and str(r).strip()))
+
+        if not registration_numbers:
+            raise ValueError('No registration numbers provided')
+        if len(registration_numbers) > BATCH_MAX_SIZE:
+            raise ValueError(f'Too many registration numbers (max {BATCH_MAX_SIZE})')
+
+        source = params.get('source') or 'lms'
+        if source not in ('lms', 'attendance', 'both'):
+            raise ValueError(f'Unknown source: {source}')
+        if needs_credit_hours and source == 'attendance':
+            raise ValueError('Attendance records have no credit hours; use source=lms or source=both')
+        sources = ['lms', 'attendance'] if source == 'both' else [source]
+
+        try:
+            concurrency = int(params.get('concurrency') or BATCH_DEFAULT_CONCURRENCY)
+        except (TypeError, ValueError):
+            concurrency = BATCH_DEFAULT_CONCURRENCY
+        return registration_numbers, sources, max(1, min(concurrency, BATCH_MAX_CONCURRENCY))
+
+    def iter_batch(self, registration_numbers, sources, concurrency):
+        """
+        Fans a batch out over a worker pool and yields one record per student as it completes.
+        Each upstream call goes through the cache, the single-flight layer and the upstream's rate limiter.
+        At most `concurrency` students are in flight and a record is dropped once yielded, so memory stays
+        flat for large batches; closing the generator early cancels the students not yet started.
+        """
+        fetchers = {name: self.rate_limited(name, fetch) for name, fetch in self.scrape_sources().items() if name in sources}
+
+        def scrape_student(registration_number):
+            source_results = self.fetch_sources(registration_number, fetchers)
+            return {'registrationNumber': registration_number,
+                    'success': any(result['success'] for result in source_results.values()),
+                    'sources': source_results}
+
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+        pending = set()
+        remaining = iter(registration_numbers)
         try:
-            session = requests.Session()
-            session.headers.update({'User-Agent': random.choice(USER_AGENTS)})
+            while True:
+                for registration_number in remaining:
+                    pending.add(executor.submit(scrape_student, registration_number))
+                    if len(pending) >= concurrency:
+                        break
+                if not pending:
+                    break
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        finally:
+            # On a disconnect or failed write, don't wait for in-flight scrapes the client will never see
+            executor.shutdown(wait=False, cancel_futures=True)
 
-            # 1. GET the main page to retrieve VIEWSTATE and EVENTVALIDATION
+    def fetch_sources(self, registration_number, fetchers):
+        """
+        Looks a student up on several upstreams at once (through the cache), so the total
+        latency is that of the slowest upstream. Returns {source: {success, message, resultData, cacheHit, cacheAge}}.
+        """
+        def fetch_one(name, fetch):
             try:
-                logger.info(f"Connecting to Attendance System at {BASE_URL}...")
-                response = session.get(BASE_URL + DEFAULT_PAGE, timeout=20)
-                response.raise_for_status()
-            except requests.exceptions.RequestException as e:
-                logger.error(f"Failed to connect to Attendance System: {e}")
-                return False, "Could not connect to UAF Attendance System. The server may be down.", None
+                success, message, result_data, cache_hit, cache_age = self.fetch_cached(name, registration_number, fetch)
+            except Exception as e:
+                success, message, result_data, cache_hit, cache_age = False, f"An unexpected error occurred: {str(e)}", None, False, 0
+            return {'success': success, 'message': message, 'resultData': result_data,
+                    'cacheHit': cache_hit, 'cacheAge': cache_age}
 
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            viewstate = soup.find('input', {'id': '__VIEWSTATE'})
-            eventvalidation = soup.find('input', {'id': '__EVENTVALIDATION'})
-
-            if not viewstate:
-                logger.warning("Could not find __VIEWSTATE on attendance system page.")
-                return False, "Could not parse the Attendance System page (VIEWSTATE missing).", None
-
-            if not eventvalidation:
-                logger.warning("Could not find __EVENTVALIDATION on attendance system page.")
-                return False, "Could not parse the Attendance System page (EVENTVALIDATION missing).", None
-
-            form_data = {
-                '__VIEWSTATE': viewstate.get('value', ''),
-                '__EVENTVALIDATION': eventvalidation.get('value', ''),
-                'ctl00$Main$txtReg': registration_number,
-                'ctl00$Main$btnShow': 'Access To Student Information'
+        if len(fetchers) == 1:
+            name, fetch = next(iter(fetchers.items()))
+            return {name: fetch_one(name, fetch)}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(fetchers)) as executor:
+            futures = {name: executor.submit(fetch_one, name, fetch) for name, fetch in fetchers.items()}
+            return {name: future.result() for name, future in futures.items()}
+
+    def handle_scrape_all(self):
+        """
+        Handle a combined LMS + Attendance System lookup.
+        Both upstreams are scraped concurrently and their courses merged server-side,
+        de-duplicated by course code and semester. Every merged record carries 'Source'
+        (where the kept record came from) and 'Sources' (every upstream that reported it).
+        """
+        try:
+            params = self.read_params()
+            registration_number = self.registration_number_param(params)
+
+            if not registration_number:
+                self.send_error_response(400, 'No registration number provided')
+                return
+
+            source_results = self.fetch_sources(registration_number, self.scrape_sources())
+            merged = merge_source_results(source_results['lms']['resultData'], source_results['attendance']['resultData'])
+            success = bool(merged)
+            if success:
+                message = f"Successfully merged {len(merged)} records"
+            else:
+                message = ' '.join(result['message'] for result in source_results.values() if result['message'])
+
+            response = {
+                'success': success,
+                'message': message,
+                'resultData': merged,
+                'sources': {name: {key: value for key, value in result.items() if key != 'resultData'}
+                            for name, result in source_results.items()}
             }
+            if self.wants_stream(params):
+                self.send_semester_stream(response)
+                return
+            self.send_success_response(response)
+        except Exception as e:
+            self.send_error_response(500, f"Error scraping all sources: {str(e)}")
+
+    def run_batch(self, registration_numbers, sources, concurrency):
+        """Runs a batch to completion and returns the records in request order"""
+        order = {r: i for i, r in enumerate(registration_numbers)}
+        return sorted(self.iter_batch(registration_numbers, sources, concurrency), key=lambda r: order[r['registrationNumber']])
+
+    def handle_compute_cgpa(self):
+        """
+        Computes CGPA server-side with the same rules as the frontend.
+        Accepts {'resultData': [...]} for one student, {'students': [{'registrationNumber', 'resultData'}, ...]}
+        for a batch, or {'registrationNumbers': [...]} (with source and concurrency as for scrape_batch,
+        LMS only by default; attendance alone has no credit hours and is rejected) to scrape first
+        and compute for each student, in request order.
+        """
+        try:
+            params = self.read_params()
+
+            if params.get('resultData') is not None:
+                result = compute_cgpa(params['resultData'])
+                self.send_success_response({'success': True, 'message': 'CGPA computed', **result})
+                return
+
+            students = params.get('students')
+            if students is None and params.get('registrationNumbers'):
+                try:
+                    registration_numbers, sources, concurrency = self.batch_params(params, needs_credit_hours=True)
+                except ValueError as e:
+                    self.send_error_response(400, str(e))
+                    return
+                order = {r: i for i, r in enumerate(registration_numbers)}
+                scraped = sorted(self.iter_export_batch(registration_numbers, sources, concurrency), key=lambda student: order[student[0]])
+                students = [{'registrationNumber': registration_number, 'success': success, 'message': message, 'resultData': records or []}
+                            for registration_number, records, success, message in scraped]
+
+            if not students:
+                self.send_error_response(400, 'No results provided')
+                return
+
+            computed = compute_cgpa_many([student.get('resultData') or [] for student in students])
+            results = []
+            for student, result in zip(students, computed):
+                entry = {'registrationNumber': student.get('registrationNumber'), 'success': student.get('success', True)}
+                if 'message' in student:
+                    entry['message'] = student['message']
+                entry.update(result)
+                results.append(entry)
+            self.send_success_response({'success': True, 'message': f"CGPA computed for {len(results)} students", 'results': results})
+        except Exception as e:
+            self.send_error_response(500, f"Error computing CGPA: {str(e)}")
+
+    def handle_export(self):
+        """
+        Exports results as CSV (format=csv, the default) or as an XLSX workbook (format=xlsx) with one sheet
+        per semester plus semester GPA and CGPA summary sheets.
+        Accepts resultData (with an optional registrationNumber) for one student, students
+        ([{'registrationNumber', 'resultData'}, ...]) for results already fetched, or registrationNumbers
+        (with source and concurrency as for scrape_batch, except that attendance alone is rejected) to scrape them first.
+        Students are written as they are fetched, in completion order, so a class-wide export is
+        never held in memory: CSV is streamed chunk by chunk, XLSX is built in temporary files and then streamed.
+        """
+        try:
+            params = self.read_params()
+            export_format = str(self.response_format() or 'csv').lower()
+            if export_format not in ('csv', 'xlsx'):
+                self.send_error_response(400, f'Unknown export format: {export_format}')
+                return
+            if export_format == 'xlsx' and Workbook is None:
+                self.send_error_response(501, 'XLSX export requires openpyxl')
+                return
+
+            if params.get('resultData') is not None:
+                registration_number = params.get('registrationNumber') or next(
+                    (r.get('RegistrationNo') for r in params['resultData'] if r.get('RegistrationNo')), '')
+                students = [(registration_number, params['resultData'], True, '')]
+                filename = f"uaf-results-{registration_number}" if registration_number else 'uaf-results'
+            elif params.get('students'):
+                students = [(s.get('registrationNumber') or '', s.get('resultData'), s.get('success', True), s.get('message', ''))
+                            for s in params['students']]
+                filename = 'uaf-results'
+            else:
+                try:
+                    registration_numbers, sources, concurrency = self.batch_params(params, needs_credit_hours=True)
+                except ValueError as e:
+                    self.send_error_response(400, str(e))
+                    return
+                students = self.iter_export_batch(registration_numbers, sources, concurrency)
+                filename = f"uaf-results-{registration_numbers[0]}" if len(registration_numbers) == 1 else 'uaf-results'
+            filename = re.sub(r'[^A-Za-z0-9._-]', '-', filename) + '.' + export_format
+
+            if export_format == 'csv':
+                self.start_stream('text/csv; charset=utf-8', filename)
+                write_csv_export(students, self.send_stream_chunk)
+                self.end_stream()
+                return
+
+            with tempfile.TemporaryFile() as workbook_file:
+                write_xlsx_export(students, workbook_file)
+                size = workbook_file.tell()
+                workbook_file.seek(0)
+                self.send_response(200)
+                self._set_cors_headers()
+                self.send_header('Content-Type', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+                self.send_header('Content-Disposition', f'attachment; filename="{filename}"')
+                self.send_header('Content-Length', str(size))
+                self.end_headers()
+                for chunk in iter(lambda: workbook_file.read(EXPORT_CHUNK_SIZE), b''):
+                    self.wfile.write(chunk)
+        except Exception as e:
+            if getattr(self, 'stream_chunked', None) is not None:
+                # Headers are already out, so the client can only see the truncated body
+                logger.error(f"Export failed mid-stream: {str(e)}")
+                self.close_connection = True
+                return
+            self.send_error_response(500, f"Error exporting results: {str(e)}")
+
+    def iter_export_batch(self, registration_numbers, sources, concurrency):
+        """Scrapes a batch and yields (registration_number, records, success, message) per student as it completes"""
+        for record in self.iter_batch(registration_numbers, sources, concurrency):
+            results = record['sources']
+            if len(sources) == 1:
+                records = results[sources[0]]['resultData']
+            else:
+                records = merge_source_results(results['lms']['resultData'], results['attendance']['resultData'])
+            message = ' '.join(result['message'] for result in results.values() if not result['success'] and result['message'])
+            yield record['registrationNumber'], records, record['success'], message
+
+    def fetch_cached(self, source, registration_number, fetch):
+        """
+        Serves a scrape result from RESULT_CACHE when possible.
+        Returns (success, message, result_data, cache_hit, cache_age).
+        Stale entries are returned immediately and refreshed in the background.
+        Only successful results are cached.
+        The whole lookup is timed as the 'lookup' stage, with the path it took as the outcome.
+        """
+        with self.stage(source, 'lookup') as lookup:
+            key = (source, registration_number.strip().lower())
+            value, age, state = RESULT_CACHE.get(key)
+
+            # While the upstream's circuit is open, stale data is served as-is rather than refreshed
+            if state == 'stale' and UPSTREAM_BREAKERS[source].state != 'open' and RESULT_CACHE.begin_refresh(key):
+                logger.info(f"Serving stale {source} result for {registration_number}, refreshing in background...")
+                threading.Thread(target=self._refresh_cached, args=(key, registration_number, fetch), daemon=True).start()
+
+            if state is not None:
+                lookup.outcome = 'cache_hit' if state == 'fresh' else 'cache_stale'
+                success, message, result_data = value
+                return success, message, result_data, True, round(age, 1)
+
+            (success, message, result_data), shared = SCRAPE_FLIGHTS.do(key, fetch, registration_number)
+            if shared:
+                lookup.outcome = 'coalesced'
+            else:
+                lookup.outcome = 'success' if success else 'failure'
+            if success and not shared:
+                RESULT_CACHE.set(key, (success, message, result_data))
+            elif not success and not UPSTREAM_BREAKERS[source].healthy():
+                # The upstream is failing right now; fall back to the last results we stored
+                stored, fetched_at = self.load_stored(source, key[1])
+                if stored:
+                    lookup.outcome = 'stored_fallback'
+                    logger.info(f"{source} unreachable, serving last known results for {registration_number}")
+                    return True, f"{message} Showing last known results.", stored, True, round(time.time() - fetched_at, 1)
+            return success, message, result_data, False, 0
+
+    def load_stored(self, source, registration_number):
+        if RESULT_STORE is None:
+            return None, None
+        try:
+            return RESULT_STORE.load(source, registration_number)
+        except sqlite3.Error as e:
+            logger.warning(f"Result store read failed: {str(e)}")
+            return None, None
+
+    def parse_stored(self, source, html_content, registration_number, parse):
+        """
+        Parses an upstream page through RESULT_STORE: if the page hash matches the stored one,
+        the stored records are returned without parsing; otherwise the page is parsed and
+        successful results are written back.
+        """
+        if RESULT_STORE is None:
+            return self.timed_parse(source, html_content, registration_number, parse)
+
+        key = registration_number.strip().lower()
+        page_hash = hashlib.sha256(html_content.encode('utf-8', 'replace')).hexdigest()
+        with self.stage(source, 'store') as stage:
+            stage.outcome = 'miss'
+            try:
+                if RESULT_STORE.page_hash(source, key) == page_hash:
+                    stored, _ = RESULT_STORE.load(source, key)
+                    if stored:
+                        RESULT_STORE.touch(source, key)
+                        stage.outcome = 'hit'
+                        return True, f"Successfully extracted {len(stored)} records", stored
+            except sqlite3.Error as e:
+                stage.outcome = 'error'
+                logger.warning(f"Result store read failed: {str(e)}")
+
+        success, message, result_data = self.timed_parse(source, html_content, registration_number, parse)
+        if success:
+            try:
+                RESULT_STORE.save(source, key, page_hash, result_data)
+            except sqlite3.Error as e:
+                logger.warning(f"Result store write failed: {str(e)}")
+        return success, message, result_data
+
+    def timed_parse(self, source, html_content, registration_number, parse):
+        """Runs a parse function as the 'parse' stage; pages without results count as 'failure'"""
+        with self.stage(source, 'parse') as stage:
+            success, message, result_data = parse(html_content, registration_number)
+            if not success:
+                stage.outcome = 'failure'
+            return success, message, result_data
+
+    def _refresh_cached(self, key, registration_number, fetch):
+        """Background refresh for a stale cache entry"""
+        try:
+            (success, message, result_data), shared = SCRAPE_FLIGHTS.do(key, fetch, registration_number)
+            if success and not shared:
+                RESULT_CACHE.set(key, (success, message, result_data))
+        except Exception as e:
+            logger.warning(f"Background refresh for {key} failed: {str(e)}")
+        finally:
+            RESULT_CACHE.end_refresh(key)
+
+    def scrape_attendance_system(self, registration_number):
+        """Scrapes results from the UAF Attendance System"""
+        breaker = UPSTREAM_BREAKERS['attendance']
+        if not breaker.allow():
+            return False, "UAF Attendance System appears to be down. Please try again in a few seconds.", None
+
+        RETRY_BUDGET.record_request()
+        attnd = ATTENDANCE_SESSIONS.acquire()
+        try:
+            # 1. Reuse the cached VIEWSTATE/EVENTVALIDATION, only GET the form page when we have none
+            if not attnd.token_valid():
+                error = self.attendance_load_form(attnd)
+                if error:
+                    return False, error, None
 
             # 2. POST the registration number
             try:
                 logger.info(f"Submitting registration number {registration_number} to Attendance System...")
-                post_response = session.post(BASE_URL + DEFAULT_PAGE, data=form_data, timeout=30)
+                with self.stage('attendance', 'submit') as stage:
+                    post_response = attnd.post_registration(registration_number)
+                    rejected = self.attendance_form_rejected(post_response)
+                    if rejected:
+                        stage.outcome = 'rejected'
+                    elif post_response.status_code >= 400:
+                        stage.outcome = 'http_error'
+
+                if rejected:
+                    # The cached form state went stale server-side; it must not go back into the pool
+                    attnd.invalidate()
+                    if not RETRY_BUDGET.can_retry():
+                        logger.info("Attendance System rejected the cached form state, retry budget exhausted")
+                        if post_response.status_code >= 500:
+                            breaker.record_failure()
+                        return False, "UAF Attendance System rejected the session. Please try again.", None
+
+                    # Fetch a fresh form state and retry once
+                    logger.info("Attendance System rejected the cached form state, refreshing...")
+                    error = self.attendance_load_form(attnd)
+                    if error:
+                        return False, error, None
+                    with self.stage('attendance', 'submit') as stage:
+                        post_response = attnd.post_registration(registration_number)
+                        rejected = self.attendance_form_rejected(post_response)
+                        if rejected:
+                            stage.outcome = 'rejected'
+                        elif post_response.status_code >= 400:
+                            stage.outcome = 'http_error'
+                    # A rejected fresh form state is not parsed as a result page (5xx is handled below)
+                    if rejected and post_response.status_code < 500:
+                        attnd.invalidate()
+                        return False, "UAF Attendance System rejected the session. Please try again.", None
+
                 post_response.raise_for_status()
+                breaker.record_success()
             except requests.exceptions.RequestException as e:
+                attnd.invalidate()
+                breaker.record_failure()
                 logger.error(f"Failed to submit form to Attendance System: {e}")
                 return False, "Error while fetching results from Attendance System.", None
-            
+
             # 3. Parse the result page
-            return self.parse_attendance_results(post_response.text, registration_number)
-        
+            return self.parse_stored('attendance', post_response.text, registration_number, self.parse_attendance_results)
+
         except Exception as e:
+            attnd.invalidate()
             logger.error(f"Unexpected error during attendance scraping: {str(e)}")
             return False, f"An unexpected error occurred: {str(e)}", None
+        finally:
+            ATTENDANCE_SESSIONS.release(attnd)
+
+    def attendance_load_form(self, attnd):
+        """
+        GETs default.aspx on a pooled session and stores its VIEWSTATE/EVENTVALIDATION.
+        Returns an error message, or None on success.
+        """
+        try:
+            logger.info(f"Connecting to Attendance System at {ATTENDANCE_BASE_URL}...")
+            with self.stage('attendance', 'form'):
+                response = upstream_call('attendance', 'form', attnd.session.get, ATTENDANCE_BASE_URL + ATTENDANCE_PAGE)
+                response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            UPSTREAM_BREAKERS['attendance'].record_failure()
+            logger.error(f"Failed to connect to Attendance System: {e}")
+            return "Could not connect to UAF Attendance System. The server may be down."
+
+        with self.stage('attendance', 'token') as stage:
+            viewstate = extract_hidden_input(response.text, '__VIEWSTATE')
+            eventvalidation = extract_hidden_input(response.text, '__EVENTVALIDATION')
+            if viewstate is None or eventvalidation is None:
+                stage.outcome = 'failure'
+
+        if viewstate is None:
+            logger.warning("Could not find __VIEWSTATE on attendance system page.")
+            return "Could not parse the Attendance System page (VIEWSTATE missing)."
+
+        if eventvalidation is None:
+            logger.warning("Could not find __EVENTVALIDATION on attendance system page.")
+            return "Could not parse the Attendance System page (EVENTVALIDATION missing)."
+
+        attnd.set_form_state(viewstate, eventvalidation)
+        return None
+
+    def attendance_form_rejected(self, response):
+        """Detects ASP.NET refusing a POST because of stale VIEWSTATE/EVENTVALIDATION"""
+        if response.status_code >= 500:
+            return True
+        page_text = response.text.lower()
+        return any(marker in page_text for marker in ATTENDANCE_REJECTION_MARKERS)
+
+    def tokenize_page(self, html_content):
+        """Runs the fast single-pass parser, falling back to BeautifulSoup if it chokes"""
+        try:
+            return ResultPageParser.parse(html_content)
+        except Exception as e:
+            logger.warning(f"Fast result parser failed ({str(e)}), falling back to BeautifulSoup")
+            return soup_tables(html_content)
 
     def parse_attendance_results(self, html_content, registration_number):
         """Parses the result table from the Attendance System HTML"""
         try:
-            soup = BeautifulSoup(html_content, 'html.parser')
-            
             # Check for common errors first
             if "object moved to" in html_content.lower() or "student registration no. not found" in html_content.lower():
                 logger.warning(f"No results found for {registration_number} on Attendance System.")
                 return False, f"No results found for {registration_number} on Attendance System.", None
-                
-            result_table = soup.find('table', {'id': 'ctl00_Main_TabContainer1_tbResultInformation_gvResultInformation'})
-            
+
+            _, tables = self.tokenize_page(html_content)
+            result_table = next((t for t in tables if t['id'] == 'ctl00_Main_TabContainer1_tbResultInformation_gvResultInformation'), None)
+
             if not result_table:
                 logger.warning(f"Could not find result table for {registration_number} on Attendance System.")
                 return False, "Could not find result table on Attendance System page. The registration number may be incorrect.", None
-                
+
             results = []
-            header_rows = 1  # The first <tr> is the header
-            
-            for row in result_table.find_all('tr'):
-                if header_rows > 0:
-                    header_rows -= 1
-                    continue
-                
-                cols = row.find_all('td')
+            # The first <tr> is the header
+            for row in result_table['rows'][1:]:
+                cols = [col.strip() for col in row['cells']]
                 if len(cols) == 16:  # 16 columns as per the HTML structure
-                    try:
-                        course_data = {
-                            'RegistrationNo': cols[0].text.strip(),
-                            'Year': cols[1].text.strip(),
-                            'Sem': cols[2].text.strip(),
-                            'Semester': cols[3].text.strip(), # Using semestername
-                            'TeacherName': cols[4].text.strip(),
-                            'CourseCode': cols[5].text.strip(),
-                            'CourseName': cols[6].text.strip(),
-                            'DegreeName': cols[7].text.strip(),
-                            'Mid': cols[8].text.strip(),
-                            'Assigment': cols[9].text.strip(),
-                            'Final': cols[10].text.strip(),
-                            'Practical': cols[11].text.strip(),
-                            'Totalmark': cols[12].text.strip(),
-                            'Grade': cols[13].text.strip(),
-                            'Markinwords': cols[14].text.strip(),
-                            'Status': cols[15].text.strip()
-                        }
-                        results.append(course_data)
-                    except Exception as e:
-                        logger.error(f"Error parsing attendance result row: {e}")
-                        
+                    results.append({
+                        'RegistrationNo': cols[0],
+                        'Year': cols[1],
+                        'Sem': cols[2],
+                        'Semester': cols[3], # Using semestername
+                        'TeacherName': cols[4],
+                        'CourseCode': cols[5],
+                        'CourseName': cols[6],
+                        'DegreeName': cols[7],
+                        'Mid': cols[8],
+                        'Assigment': cols[9],
+                        'Final': cols[10],
+                        'Practical': cols[11],
+                        'Totalmark': cols[12],
+                        'Grade': cols[13],
+                        'Markinwords': cols[14],
+                        'Status': cols[15]
+                    })
+
             if results:
                 logger.info(f"Successfully extracted {len(results)} records from Attendance System for {registration_number}.")
                 return True, f"Successfully extracted {len(results)} records", results
             else:
                 logger.warning(f"Result table was found but no data rows could be parsed for {registration_number}.")
                 return False, f"No result data found in table for: {registration_number}", None
-                
+
         except Exception as e:
             logger.error(f"Error parsing attendance results: {str(e)}")
             return False, f"Error parsing results: {str(e)}", None
@@ -312,60 +2288,183 @@ class handler(BaseHTTPRequestHandler):
 
     def scrape_uaf_results(self, registration_number):
         """Main function to scrape UAF results with HTTP/HTTPS fallback"""
-        session = requests.Session()
-        session.headers.update({'User-Agent': random.choice(USER_AGENTS)})
-        
-        # Priority updated: HTTPS first, then HTTP
-        schemes = ['https', 'http']
-        response = None
-        base_url = ''
-        
-        for scheme in schemes:
-            try:
-                base_url = f"{scheme}://lms.uaf.edu.pk"
-                login_url = f"{base_url}/login/index.php"
-                logger.info(f"Attempting connection to UAF LMS via {scheme.upper()}...")
-                
-                # Timeout updated to 3 seconds as requested
-                response = session.get(login_url, timeout=3, verify=False)
-                response.raise_for_status()
-                logger.info(f"Successfully connected via {scheme.upper()}.")
-                break 
-            except requests.exceptions.RequestException as e:
-                logger.warning(f"{scheme.upper()} connection failed: {e}")
-                response = None 
-        
-        if not response:
-            logger.error("Both HTTPS and HTTP connections failed.")
-            return False, "Could not connect to UAF LMS. The server may be down or blocking requests.", None
+        breaker = UPSTREAM_BREAKERS['lms']
+        if not breaker.allow():
+            return False, "UAF LMS appears to be down. Please try again in a few seconds.", None
 
+        RETRY_BUDGET.record_request()
+        lms = LMS_SESSIONS.acquire()
         try:
-            token = self.extract_js_token(response.text)
-            if not token:
-                soup = BeautifulSoup(response.text, 'html.parser')
-                token_input = soup.find('input', {'id': 'token'})
-                token = token_input.get('value') if token_input else None
-            
-            if not token:
-                return False, "Could not extract security token from UAF LMS. The site structure may have changed.", None
-            
-            result_url = f"{base_url}/course/uaf_student_result.php"
-            form_data = {'token': token, 'Register': registration_number}
-            headers = {'Referer': login_url, 'Origin': base_url}
-            
-            # Keep a slightly longer timeout for the actual result fetch as it might take longer than the ping
-            post_response = session.post(result_url, data=form_data, timeout=10, verify=False)
-            
+            if not lms.token_valid():
+                error = self.lms_login(lms)
+                if error:
+                    return False, error, None
+
+            result_url = f"{lms.base_url}/course/uaf_student_result.php"
+            # The result fetch gets its own (longer) adaptive timeout, it takes longer than the login ping
+            with self.stage('lms', 'result') as stage:
+                post_response = upstream_call('lms', 'result', lms.session.post, result_url, data={'token': lms.token, 'Register': registration_number}, verify=False)
+                rejected = self.lms_token_rejected(post_response)
+                if rejected:
+                    stage.outcome = 'rejected'
+                elif post_response.status_code != 200:
+                    stage.outcome = 'http_error'
+
+            if rejected:
+                # Token expired server-side or the session was dropped; it must not go back into the pool
+                lms.invalidate()
+                if not RETRY_BUDGET.can_retry():
+                    logger.info("UAF LMS rejected the cached token, retry budget exhausted")
+                    return False, "UAF LMS rejected the session. Please try again.", None
+
+                # Log in again and retry once
+                logger.info("UAF LMS rejected the cached token, refreshing...")
+                error = self.lms_login(lms)
+                if error:
+                    return False, error, None
+                result_url = f"{lms.base_url}/course/uaf_student_result.php"
+                with self.stage('lms', 'result') as stage:
+                    post_response = upstream_call('lms', 'result', lms.session.post, result_url, data={'token': lms.token, 'Register': registration_number}, verify=False)
+                    rejected = self.lms_token_rejected(post_response)
+                    if rejected:
+                        stage.outcome = 'rejected'
+                    elif post_response.status_code != 200:
+                        stage.outcome = 'http_error'
+                # A login page is never parsed as a result page
+                if rejected:
+                    lms.invalidate()
+                    return False, "UAF LMS rejected the session. Please try again.", None
+
+            if post_response.status_code >= 500:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+
             if post_response.status_code != 200:
+                lms.invalidate()
                 return False, f"UAF LMS returned status code {post_response.status_code} when fetching results.", None
-            
-            return self.parse_uaf_results(post_response.text, registration_number)
+
+            return self.parse_stored('lms', post_response.text, registration_number, self.parse_uaf_results)
         except requests.exceptions.RequestException as e:
+            lms.invalidate()
+            breaker.record_failure()
             return False, f"Network error during scraping: {str(e)}. UAF LMS may be unavailable.", None
         except Exception as e:
+            lms.invalidate()
             logger.error(f"Unexpected error during scraping logic: {str(e)}")
             return False, f"An unexpected error occurred: {str(e)}", None
+        finally:
+            LMS_SESSIONS.release(lms)
+
+    def lms_login(self, lms):
+        """
+        GETs the LMS login page on a pooled session and stores its token.
+        Returns an error message, or None on success.
+        """
+        with self.stage('lms', 'login') as stage:
+            response, base_url = self.lms_hedged_get(lms)
+            if not response:
+                stage.outcome = 'failure'
+
+        if not response:
+            logger.error("Both HTTPS and HTTP connections failed.")
+            return "Could not connect to UAF LMS. The server may be down or blocking requests."
+
+        with self.stage('lms', 'token') as stage:
+            token = self.extract_js_token(response.text)
+            if not token:
+                soup = BeautifulSoup(response.text, 'html.parser')
+                token_input = soup.find('input', {'id': 'token'})
+                token = token_input.get('value') if token_input else None
+            if not token:
+                stage.outcome = 'failure'
+
+        if not token:
+            return "Could not extract security token from UAF LMS. The site structure may have changed."
+
+        lms.set_token(base_url, token)
+        return None
+
+    def lms_hedged_get(self, lms):
+        """
+        Hedged connect to the LMS login page.
+        Starts on the last scheme that worked, fires the other scheme after LMS_HEDGE_DELAY
+        (or as soon as the first one fails) and takes whichever answers first. Only the hedge fired
+        while the first scheme is still in flight is charged to the retry budget.
+        The hedge runs on its own session so the two attempts never share a cookie jar;
+        if it wins, it replaces the pooled session.
+        Returns (response, base_url), or (None, '') if both schemes failed.
+        """
+        preferred = LMS_SCHEME_STATE['preferred']
+        schemes = [preferred] + [scheme for scheme in ('https', 'http') if scheme != preferred]
+
+        def attempt(scheme, session):
+            login_url = f"{scheme}://{LMS_HOST}/login/index.php"
+            logger.info(f"Attempting connection to UAF LMS via {scheme.upper()}...")
+            response = upstream_call('lms', 'login', session.get, login_url, verify=False)
+            response.raise_for_status()
+            return scheme, session, response
 
+        hedge_session = None
+        hedged = False
+        hedge_denied = False
+        pending = {LMS_HEDGE_EXECUTOR.submit(attempt, schemes[0], lms.session)}
+        winner = None
+
+        while pending and winner is None:
+            # Only wait the hedge delay while a speculative hedge is still possible
+            timeout = LMS_HEDGE_DELAY if not hedged and not hedge_denied else None
+            done, pending = concurrent.futures.wait(pending, timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED)
+
+            for future in done:
+                try:
+                    winner = future.result()
+                    break
+                except requests.exceptions.RequestException as e:
+                    logger.warning(f"LMS connection attempt failed: {e}")
+
+            if winner is None and not hedged:
+                # A speculative hedge (first scheme still in flight) is extra upstream load, so it is
+                # paid for from the retry budget; failing over after the first scheme failed is always allowed
+                if pending:
+                    if hedge_denied:
+                        continue
+                    if not RETRY_BUDGET.can_retry():
+                        logger.info("Retry budget exhausted, not hedging the LMS connect")
+                        hedge_denied = True
+                        continue
+                hedged = True
+                hedge_session = requests.Session()
+                hedge_session.headers.update(lms.session.headers)
+                pending.add(LMS_HEDGE_EXECUTOR.submit(attempt, schemes[1], hedge_session))
+
+        # Close the hedge session once its attempt settles, unless it won
+        if hedge_session is not None and (winner is None or winner[1] is not hedge_session):
+            for future in pending:
+                future.add_done_callback(lambda _f, s=hedge_session: s.close())
+            if not pending:
+                hedge_session.close()
+
+        if winner is None:
+            UPSTREAM_BREAKERS['lms'].record_failure()
+            return None, ''
+
+        scheme, session, response = winner
+        logger.info(f"Successfully connected via {scheme.upper()}.")
+        if session is not lms.session:
+            lms.session.close()
+            lms.session = session
+        if scheme != LMS_SCHEME_STATE['preferred']:
+            LMS_SCHEME_STATE['preferred'] = scheme
+        return response, f"{scheme}://{LMS_HOST}"
+
+    def lms_token_rejected(self, response):
+        """Detects the LMS bouncing a result POST back to the login page"""
+        if response.status_code in (401, 403, 419):
+            return True
+        if '/login/index.php' in response.url:
+            return True
+        return self.extract_js_token(response.text) is not None
 
     def extract_js_token(self, html_content):
         """Extract JavaScript-generated token from UAF LMS"""
@@ -375,28 +2474,27 @@ class handler(BaseHTTPRequestHandler):
     def parse_uaf_results(self, html_content, registration_number):
         """Parse UAF results"""
         try:
-            soup = BeautifulSoup(html_content, 'html.parser')
-            page_text = soup.get_text().lower()
+            page_text, tables = self.tokenize_page(html_content)
+            page_text = page_text.lower()
             if any(text in page_text for text in ['blocked', 'access denied', 'not available']):
                 return False, "Access blocked by UAF LMS", None
             if "no result" in page_text or "no records" in page_text:
                 return False, f"No results found for registration number: {registration_number}", None
-            
+
             student_info = {}
-            info_tables = soup.find_all('table')
-            if info_tables:
-                for row in info_tables[0].find_all('tr'):
-                    cols = row.find_all('td')
+            if tables:
+                for row in tables[0]['rows']:
+                    cols = row['cells']
                     if len(cols) == 2:
-                        key = cols[0].text.strip().replace(':', '').replace('#', '').replace(' ', '')
-                        student_info[key] = cols[1].text.strip()
-            
+                        key = cols[0].strip().replace(':', '').replace('#', '').replace(' ', '')
+                        student_info[key] = cols[1].strip()
+
             student_results = []
-            for table in soup.find_all('table'):
-                rows = table.find_all('tr')
-                if len(rows) > 5 and 'sr' in rows[0].get_text().lower():
+            for table in tables:
+                rows = table['rows']
+                if len(rows) > 5 and 'sr' in rows[0]['text'].lower():
                     for i in range(1, len(rows)):
-                        cols = [col.text.strip() for col in rows[i].find_all('td')]
+                        cols = [col.strip() for col in rows[i]['cells']]
                         if len(cols) >= 5:
                             student_results.append({
                                 'RegistrationNo': student_info.get('Registration', registration_number),
@@ -408,10 +2506,9 @@ class handler(BaseHTTPRequestHandler):
                                 'Final': cols[8] if len(cols) > 8 else '', 'Practical': cols[9] if len(cols) > 9 else '',
                                 'Total': cols[10] if len(cols) > 10 else '', 'Grade': cols[11] if len(cols) > 11 else ''
                             })
-            
+
             if student_results:
                 return True, f"Successfully extracted {len(student_results)} records", student_results
             return False, f"No result data found for: {registration_number}", None
         except Exception as e:
             return False, f"Error parsing results: {str(e)}", None
-
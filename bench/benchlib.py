@@ -0,0 +1,123 @@
+"""
+Shared helpers for the offline benchmarks: loading api/result-scraper.py, fixtures,
+percentiles and the stored results used to compare runs for regressions.
+"""
+import importlib.util
+import json
+import logging
+import os
+import platform
+import subprocess
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+FIXTURES_DIR = os.path.join(BENCH_DIR, 'fixtures')
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+SCRAPER_PATH = os.path.join(REPO_DIR, 'api', 'result-scraper.py')
+
+FIXTURES = {
+    'lms_login': 'lms_login.html',
+    'lms_result': 'lms_result.html',
+    'attendance_form': 'attendance_form.html',
+    'attendance_result': 'attendance_result.html',
+}
+
+# A benchmark regresses when it gets this much worse than the baseline (0.1 = 10%)
+DEFAULT_REGRESSION_THRESHOLD = 0.1
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, FIXTURES[name]), encoding='utf-8') as f:
+        return f.read()
+
+
+def load_scraper(env=None):
+    """
+    Imports api/result-scraper.py (its file name is not importable as a module name).
+    The scraper reads its settings from the environment at import time, so `env` is applied first.
+    Its per-request INFO logging is silenced so it does not skew timings.
+    """
+    os.environ.update(env or {})
+    spec = importlib.util.spec_from_file_location('result_scraper', SCRAPER_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    logging.disable(logging.INFO)
+    return module
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list, q in [0, 100]"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * q // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def metric(value, unit, better='lower'):
+    return {'value': value, 'unit': unit, 'better': better}
+
+
+def save_results(suite, name, metrics, config=None):
+    """
+    Stores a run as bench/results/<suite>-<name>.json.
+    `metrics` maps benchmark names to metric() dicts; `config` records the knobs the run used.
+    """
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"{suite}-{name}.json")
+    record = {
+        'suite': suite,
+        'name': name,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': config or {},
+        'metrics': metrics,
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(record, f, indent=2, sort_keys=True)
+        f.write('\n')
+    return path
+
+
+def load_results(path_or_name, suite):
+    """Accepts a path or the name a run was saved under"""
+    path = path_or_name
+    if not os.path.exists(path):
+        path = os.path.join(RESULTS_DIR, f"{suite}-{path_or_name}.json")
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare_results(baseline, metrics, threshold=DEFAULT_REGRESSION_THRESHOLD):
+    """
+    Compares metrics against a stored baseline run.
+    Returns (lines, regressions): a printable report and the names of benchmarks that got worse by more than threshold.
+    """
+    lines = [f"Compared with {baseline['name']} ({baseline.get('revision') or 'unknown revision'}, {baseline['timestamp']})"]
+    regressions = []
+    for name, current in metrics.items():
+        base = baseline['metrics'].get(name)
+        if base is None or not base['value']:
+            lines.append(f"  {name:<40} {current['value']:>12.3f} {current['unit']:<6} (no baseline)")
+            continue
+        change = (current['value'] - base['value']) / base['value']
+        worse = change > threshold if current['better'] == 'lower' else change < -threshold
+        if worse:
+            regressions.append(name)
+        lines.append(f"  {name:<40} {base['value']:>12.3f} -> {current['value']:>12.3f} {current['unit']:<6} {change:+7.1%}"
+                     + ('  REGRESSION' if worse else ''))
+    return lines, regressions
+
+
+def report(metrics):
+    return [f"  {name:<40} {m['value']:>12.3f} {m['unit']}" for name, m in metrics.items()]
@@ -0,0 +1,160 @@
+"""
+Checks the server-side CGPA engine (compute_cgpa in api/result-scraper.py) against the frontend.
+
+fixtures/cgpa_cases.json holds scraped-style records together with the totals, semester GPAs and
+per-course repeat flags that calculateCGPA in public/index.html produces for them.
+
+  python bench/check_cgpa.py                # exit 1 on any mismatch
+  python bench/check_cgpa.py --regenerate   # rebuild the fixture by running the frontend JS under node
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+
+from benchlib import FIXTURES_DIR, REPO_DIR, load_scraper
+
+CASES_PATH = os.path.join(FIXTURES_DIR, 'cgpa_cases.json')
+INDEX_HTML = os.path.join(REPO_DIR, 'public', 'index.html')
+# Frontend functions the CGPA calculation depends on
+JS_FUNCTIONS = ['processSemesterName', 'getSemesterOrderKey', 'processScrapedData',
+                'calculateQualityPoints', 'calculateCustomGrade', 'calculateCGPA']
+TOTAL_KEYS = ['cgpa', 'percentage', 'totalQualityPoints', 'totalCreditHours', 'totalMarksObtained', 'totalMaxMarks']
+
+JS_RUNNER = """
+const fs = require('fs');
+const cases = JSON.parse(fs.readFileSync(process.argv[2]));
+const expected = cases.map(c => {
+    const processed = processScrapedData({resultData: c.resultData});
+    const totals = calculateCGPA(processed);
+    return {
+        totals: Object.fromEntries(%s.map(k => [k, totals[k]])),
+        semesters: Object.entries(processed.semesters).map(([name, s]) => ({
+            name, gpa: s.gpa, percentage: s.percentage, totalQualityPoints: s.totalQualityPoints,
+            courses: s.courses.map(x => [x.code, x.qualityPoints, x.isRepeated, x.isExtraEnrolled])
+        }))
+    };
+});
+fs.writeFileSync(process.argv[3], JSON.stringify(expected));
+"""
+
+
+def handmade_cases():
+    """Edge cases of the repeat and grade rules"""
+    def course(semester, code, credit_hours, total, grade):
+        return {'Semester': semester, 'CourseCode': code, 'CourseTitle': code, 'CreditHours': credit_hours, 'Total': total, 'Grade': grade}
+    return [
+        ('failed then passed', [course('Winter 2020-2021', 'CHEM-301', '3(2-1)', '20', 'F'),
+                                course('Winter 2021-2022', 'CHEM-301', '3(2-1)', '41', 'C')]),
+        ('passed then improved', [course('Winter 2020-2021', 'MATH-101', '3(3-0)', '35', 'C'),
+                                  course('Spring 2020-2021', 'MATH-101', '3(3-0)', '50', 'B')]),
+        ('equal marks, later attempt counts', [course('Spring 2020-2021', 'ENG-101', '2(2-0)', '30', 'B'),
+                                               course('Spring 2021-2022', 'eng-101 ', '2(2-0)', '30', 'B')]),
+        ('pass/fail course', [course('Winter 2020-2021', 'ISL-101', '1(0-1)', '18', 'P'),
+                              course('Winter 2020-2021', 'PHY-101', '4(3-1)', '70', 'A')]),
+        ('attendance style semester names', [course('Winter20', 'BIO-101', '3(2-1)', '47.5', 'A'),
+                                             course('spring21', 'BIO-102', '3(2-1)', '29.75', 'C')]),
+    ]
+
+
+def generated_cases(count, seed):
+    rng = random.Random(seed)
+    semesters = ['Winter 2020-2021', 'Spring 2020-2021', 'Summer 2020-2021', 'Winter 2021-2022', 'Spring 2021-2022', 'Fall 2022', 'Winter22']
+    codes = [f"CHEM-{300 + i}" for i in range(12)] + ['MATH-101', 'ENG-101', 'STAT-201']
+    credit_hours = ['1(0-1)', '2(2-0)', '3(2-1)', '3(3-0)', '4(3-1)']
+    cases = []
+    for index in range(count):
+        records = []
+        for _ in range(rng.randint(4, 20)):
+            ch = rng.choice(credit_hours)
+            total = rng.uniform(0, 20 * int(ch[0]))
+            total = f"{total:.0f}" if rng.random() < 0.7 else f"{total:.2f}"
+            records.append({'Semester': rng.choice(semesters), 'CourseCode': rng.choice(codes), 'CourseTitle': 'Course',
+                            'CreditHours': ch, 'Total': total, 'Grade': rng.choice(['A', 'B', 'C', 'D', 'F', 'P'])})
+        cases.append((f"generated {index}", records))
+    return cases
+
+
+def extract_js_functions():
+    with open(INDEX_HTML, encoding='utf-8') as f:
+        source = f.read()
+    functions = ['const BED_COURSES = new Set();']
+    for name in JS_FUNCTIONS:
+        start = source.index(f"function {name}(")
+        depth, position = 0, source.index('{', start)
+        while True:
+            if source[position] == '{':
+                depth += 1
+            elif source[position] == '}':
+                depth -= 1
+                if depth == 0:
+                    break
+            position += 1
+        functions.append(source[start:position + 1])
+    return '\n'.join(functions)
+
+
+def regenerate():
+    cases = [{'name': name, 'resultData': records} for name, records in handmade_cases() + generated_cases(15, seed=12)]
+    with tempfile.TemporaryDirectory() as tmp:
+        runner, cases_file, expected_file = (os.path.join(tmp, name) for name in ('run.js', 'cases.json', 'expected.json'))
+        with open(runner, 'w', encoding='utf-8') as f:
+            f.write(extract_js_functions() + JS_RUNNER % json.dumps(TOTAL_KEYS))
+        with open(cases_file, 'w', encoding='utf-8') as f:
+            json.dump(cases, f)
+        subprocess.run(['node', runner, cases_file, expected_file], check=True)
+        with open(expected_file, encoding='utf-8') as f:
+            expected = json.load(f)
+    for case, result in zip(cases, expected):
+        case['expected'] = result
+    with open(CASES_PATH, 'w', encoding='utf-8') as f:
+        # One case per line keeps the fixture small and its diffs readable
+        f.write('[\n' + ',\n'.join(json.dumps(case) for case in cases) + '\n]\n')
+    print(f"Wrote {len(cases)} cases to {CASES_PATH}")
+
+
+def check(scraper):
+    with open(CASES_PATH, encoding='utf-8') as f:
+        cases = json.load(f)
+    mismatches = []
+    for case in cases:
+        result = scraper.compute_cgpa(case['resultData'])
+        expected = case['expected']
+        for key in TOTAL_KEYS:
+            if result[key] != expected['totals'][key]:
+                mismatches.append(f"{case['name']}: {key} {result[key]!r} != {expected['totals'][key]!r}")
+        semesters = {s['name']: s for s in result['semesters']}
+        if set(semesters) != {s['name'] for s in expected['semesters']}:
+            mismatches.append(f"{case['name']}: semesters {sorted(semesters)} != {sorted(s['name'] for s in expected['semesters'])}")
+            continue
+        for want in expected['semesters']:
+            got = semesters[want['name']]
+            for key in ('gpa', 'percentage', 'totalQualityPoints'):
+                if got[key] != want[key]:
+                    mismatches.append(f"{case['name']}: {want['name']} {key} {got[key]!r} != {want[key]!r}")
+            courses = [[c['code'], c['qualityPoints'], c['isRepeated'], c['isExtraEnrolled']] for c in got['courses']]
+            if courses != want['courses']:
+                mismatches.append(f"{case['name']}: {want['name']} courses {courses} != {want['courses']}")
+    return len(cases), mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--regenerate', action='store_true', help='rebuild the fixture from public/index.html (needs node)')
+    args = parser.parse_args()
+    if args.regenerate:
+        regenerate()
+
+    count, mismatches = check(load_scraper({'RESULT_STORE_PATH': ''}))
+    if mismatches:
+        print('\n'.join(mismatches))
+        print(f"{len(mismatches)} mismatches in {count} cases")
+        sys.exit(1)
+    print(f"compute_cgpa matches calculateCGPA on {count} cases")
+
+
+if __name__ == '__main__':
+    main()
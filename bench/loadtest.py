@@ -0,0 +1,133 @@
+"""
+End-to-end load driver: runs the result-scraper `handler` on a local HTTP server, points it at the
+stub LMS/Attendance System (bench/stub_server.py) and reports throughput and p50/p95/p99 latency.
+
+  python bench/loadtest.py --requests 500 --concurrency 16 --latency 0.05
+  python bench/loadtest.py --action scrape_all --failure-rate 0.05 --failure-mode reset
+  python bench/loadtest.py --save baseline / --compare baseline
+"""
+import argparse
+import concurrent.futures
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from http.server import ThreadingHTTPServer
+
+import requests
+
+from benchlib import (DEFAULT_REGRESSION_THRESHOLD, compare_results, load_results, load_scraper,
+                      metric, percentile, report, save_results)
+from stub_server import FAILURE_MODES, StubUpstream
+
+ACTIONS = ('scrape_single', 'scrape_attendance', 'scrape_all')
+
+
+def registration_numbers(count, hot_ratio, hot_set, seed):
+    """Unique numbers (cache misses) mixed with a small hot set that repeats (cache hits)"""
+    rng = random.Random(seed)
+    hot = [f"2019-ag-{i:04d}" for i in range(hot_set)]
+    return [rng.choice(hot) if hot and rng.random() < hot_ratio else f"2020-ag-{i:05d}" for i in range(count)]
+
+
+def run_load(base_url, action, numbers, concurrency):
+    """Fires the lookups from `concurrency` client threads; returns (elapsed, [(latency, ok)])"""
+    local = threading.local()
+
+    def lookup(registration_number):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        started = time.perf_counter()
+        try:
+            response = session.post(f"{base_url}?action={action}", json={'registrationNumber': registration_number}, timeout=120)
+            ok = response.status_code == 200 and response.json().get('success', False)
+        except (requests.exceptions.RequestException, ValueError):
+            ok = False
+        return time.perf_counter() - started, ok
+
+    started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        samples = list(executor.map(lookup, numbers))
+    return time.perf_counter() - started, samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--action', choices=ACTIONS, default='scrape_single')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--warmup', type=int, default=10, help='unmeasured lookups that warm sessions and timeouts')
+    parser.add_argument('--hot-ratio', type=float, default=0.0, help='share of lookups drawn from a repeating hot set')
+    parser.add_argument('--hot-set', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.05, help='stub base latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.2)
+    parser.add_argument('--slow-rate', type=float, default=0.0)
+    parser.add_argument('--slow-latency', type=float, default=1.0)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--failure-mode', choices=FAILURE_MODES, default='status')
+    parser.add_argument('--no-store', action='store_true', help='disable the SQLite result store')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save', metavar='NAME', help='store this run under NAME')
+    parser.add_argument('--compare', metavar='NAME_OR_PATH', help='compare with a stored run')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_REGRESSION_THRESHOLD)
+    args = parser.parse_args()
+
+    stub = StubUpstream(latency=args.latency, jitter=args.jitter, slow_rate=args.slow_rate,
+                        slow_latency=args.slow_latency, failure_rate=args.failure_rate,
+                        failure_mode=args.failure_mode, seed=args.seed).start()
+    store_dir = tempfile.TemporaryDirectory()
+    env = dict(stub.env, RESULT_STORE_PATH='' if args.no_store else os.path.join(store_dir.name, 'results.sqlite3'))
+    scraper = load_scraper(env)
+
+    class QuietHandler(scraper.handler):
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), QuietHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/api/result-scraper"
+
+    try:
+        if args.warmup:
+            run_load(base_url, args.action, [f"2018-ag-{i:04d}" for i in range(args.warmup)], min(args.concurrency, args.warmup))
+        stub.counts.clear()
+        numbers = registration_numbers(args.requests, args.hot_ratio, args.hot_set, args.seed)
+        elapsed, samples = run_load(base_url, args.action, numbers, args.concurrency)
+    finally:
+        server.shutdown()
+        stub.stop()
+        store_dir.cleanup()
+
+    latencies = sorted(latency for latency, _ in samples)
+    succeeded = sum(1 for _, ok in samples if ok)
+    metrics = {
+        'throughput': metric(len(samples) / elapsed, 'req/s', better='higher'),
+        'latency_p50': metric(percentile(latencies, 50) * 1000, 'ms'),
+        'latency_p95': metric(percentile(latencies, 95) * 1000, 'ms'),
+        'latency_p99': metric(percentile(latencies, 99) * 1000, 'ms'),
+        'latency_max': metric(latencies[-1] * 1000, 'ms'),
+        'success_rate': metric(succeeded / len(samples), 'ratio', better='higher'),
+    }
+    print(f"{len(samples)} x {args.action}, concurrency {args.concurrency}, {elapsed:.2f}s")
+    print('\n'.join(report(metrics)))
+    print('Upstream requests: ' + ', '.join(f"{name} {outcome}={count}" for (name, outcome), count in sorted(stub.counts.items())))
+
+    config = {key: value for key, value in vars(args).items() if key not in ('save', 'compare', 'threshold')}
+    if args.save:
+        print(f"Saved to {save_results('load', args.save, metrics, config)}")
+    if args.compare:
+        baseline = load_results(args.compare, 'load')
+        if baseline['config'] != config:
+            print(f"Warning: baseline was run with different settings: {baseline['config']}")
+        lines, regressions = compare_results(baseline, metrics, args.threshold)
+        print('\n'.join(lines))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Microbenchmarks for the scraper's parsing hot paths, run on the recorded pages in bench/fixtures.
+
+  python bench/microbench.py                        # print timings
+  python bench/microbench.py --save baseline        # store as bench/results/micro-baseline.json
+  python bench/microbench.py --compare baseline     # exit 1 if anything regressed past --threshold
+"""
+import argparse
+import statistics
+import sys
+import timeit
+
+from benchlib import (DEFAULT_REGRESSION_THRESHOLD, FIXTURES, compare_results, load_fixture, load_results,
+                      load_scraper, metric, report, save_results)
+
+REGISTRATION_NUMBER = '2020-ag-1234'
+
+
+def check_parser_equivalence(scraper):
+    """The fast ResultPageParser must tokenize every fixture exactly like the BeautifulSoup path it replaced"""
+    for name in FIXTURES:
+        page = load_fixture(name)
+        if scraper.ResultPageParser.parse(page) != scraper.soup_tables(page):
+            raise RuntimeError(f"ResultPageParser output differs from soup_tables on the {name} fixture")
+
+
+def benchmarks(scraper):
+    """name -> zero-argument callable; each one is checked once so a broken parser cannot benchmark fast"""
+    check_parser_equivalence(scraper)
+    handler = scraper.handler.__new__(scraper.handler)
+    lms_login = load_fixture('lms_login')
+    lms_result = load_fixture('lms_result')
+    attendance_result = load_fixture('attendance_result')
+
+    cases = {
+        'parse_uaf_results': lambda: handler.parse_uaf_results(lms_result, REGISTRATION_NUMBER),
+        'parse_attendance_results': lambda: handler.parse_attendance_results(attendance_result, REGISTRATION_NUMBER),
+        'extract_js_token': lambda: handler.extract_js_token(lms_login),
+    }
+    for name, case in cases.items():
+        result = case()
+        ok = result is not None if name == 'extract_js_token' else result[0]
+        if not ok:
+            raise RuntimeError(f"{name} failed on its fixture: {result!r}")
+    return cases
+
+
+def time_case(case, repeat):
+    """Median seconds per call over `repeat` runs, each sized by timeit's autorange (>= 0.2s)"""
+    timer = timeit.Timer(case)
+    number, _ = timer.autorange()
+    return statistics.median(t / number for t in timer.repeat(repeat=repeat, number=number))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--save', metavar='NAME', help='store this run under NAME')
+    parser.add_argument('--compare', metavar='NAME_OR_PATH', help='compare with a stored run')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_REGRESSION_THRESHOLD)
+    args = parser.parse_args()
+
+    scraper = load_scraper({'RESULT_STORE_PATH': ''})
+    metrics = {name: metric(time_case(case, args.repeat) * 1e6, 'us')
+               for name, case in benchmarks(scraper).items()}
+    print('\n'.join(report(metrics)))
+
+    if args.save:
+        print(f"Saved to {save_results('micro', args.save, metrics, {'repeat': args.repeat})}")
+    if args.compare:
+        lines, regressions = compare_results(load_results(args.compare, 'micro'), metrics, args.threshold)
+        print('\n'.join(lines))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+"""
+Local stand-in for the UAF LMS and Attendance System.
+
+Replays the recorded pages in bench/fixtures with configurable latency and failure injection:
+  GET  /login/index.php               LMS login page (carries the JS token)
+  POST /course/uaf_student_result.php LMS result page, or the login page again if the token is wrong
+  GET  /default.aspx                  Attendance System form (VIEWSTATE/EVENTVALIDATION)
+  POST /default.aspx                  Attendance System result page, or a 500 without form state
+
+Point the scraper at it with
+  LMS_HOST=127.0.0.1:<port> LMS_PREFERRED_SCHEME=http ATTENDANCE_BASE_URL=http://127.0.0.1:<port>/
+"""
+import argparse
+import random
+import re
+import threading
+import time
+import urllib.parse
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchlib import load_fixture
+
+FAILURE_MODES = ('status', 'reset', 'timeout')
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.route(head=True)
+
+    def do_GET(self):
+        self.route()
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self.form = urllib.parse.parse_qs(self.rfile.read(length).decode()) if length else {}
+        self.route()
+
+    def route(self, head=False):
+        stub = self.server.stub
+        path = urllib.parse.urlsplit(self.path).path
+        if path == '/login/index.php' and self.command in ('GET', 'HEAD'):
+            name = 'lms_login'
+        elif path == '/course/uaf_student_result.php' and self.command == 'POST':
+            name = 'lms_result'
+        elif path == '/default.aspx' and self.command in ('GET', 'HEAD'):
+            name = 'attendance_form'
+        elif path == '/default.aspx' and self.command == 'POST':
+            name = 'attendance_result'
+        else:
+            return self.reply(404, b'Not found', head=head)
+
+        if not stub.inject(self, name):
+            return
+
+        if name == 'lms_result' and self.form.get('token', [None])[0] != stub.lms_token:
+            # Moodle sends a bad or expired token back to the login page
+            name = 'lms_login'
+        elif name == 'attendance_result' and not self.form.get('__VIEWSTATE'):
+            stub.count(name, 'rejected')
+            return self.reply(500, b'Validation of viewstate MAC failed.')
+        stub.count(name, 'ok')
+        self.reply(200, stub.pages[name], head=head)
+
+    def reply(self, status, body, head=False):
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+
+class StubUpstream:
+    """
+    Serves the fixtures on 127.0.0.1.
+    latency: base delay in seconds, varied by +/- jitter (a fraction of latency).
+    slow_rate / slow_latency: share of requests that take slow_latency instead, to give the latency a tail.
+    failure_rate / failure_mode: share of requests that fail with a 503 ('status'), a dropped
+    connection ('reset') or no answer for timeout_delay seconds ('timeout').
+    """
+    def __init__(self, port=0, latency=0.0, jitter=0.0, slow_rate=0.0, slow_latency=1.0,
+                 failure_rate=0.0, failure_mode='status', timeout_delay=30.0, seed=None):
+        if failure_mode not in FAILURE_MODES:
+            raise ValueError(f"Unknown failure mode: {failure_mode}")
+        self.latency = latency
+        self.jitter = jitter
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.failure_rate = failure_rate
+        self.failure_mode = failure_mode
+        self.timeout_delay = timeout_delay
+        self.random = random.Random(seed)
+        self.pages = {name: load_fixture(name).encode('utf-8') for name in ('lms_login', 'lms_result', 'attendance_form', 'attendance_result')}
+        token = re.search(rb"document\.getElementById\('token'\)\.value\s*=\s*'([^']+)'", self.pages['lms_login'])
+        self.lms_token = token.group(1).decode() if token else None
+        self.counts = Counter()
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), StubHandler)
+        self.server.daemon_threads = True
+        self.server.stub = self
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    @property
+    def env(self):
+        """Environment that points api/result-scraper.py at this stub"""
+        return {'LMS_HOST': f"127.0.0.1:{self.port}", 'LMS_PREFERRED_SCHEME': 'http',
+                'ATTENDANCE_BASE_URL': f"http://127.0.0.1:{self.port}/"}
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count(self, name, outcome):
+        with self._lock:
+            self.counts[(name, outcome)] += 1
+
+    def inject(self, request, name):
+        """Applies latency and failure injection; returns False if the request was failed"""
+        with self._lock:
+            failed = self.random.random() < self.failure_rate
+            slow = self.random.random() < self.slow_rate
+            delay = self.slow_latency if slow else self.latency * (1 + self.jitter * (2 * self.random.random() - 1))
+        if delay > 0:
+            time.sleep(delay)
+        if not failed:
+            return True
+
+        self.count(name, self.failure_mode)
+        if self.failure_mode == 'status':
+            request.reply(503, b'Service Unavailable')
+        elif self.failure_mode == 'timeout':
+            time.sleep(self.timeout_delay)
+            request.close_connection = True
+        else:
+            request.close_connection = True
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8800)
+    parser.add_argument('--latency', type=float, default=0.05, help='base response delay in seconds')
+    parser.add_argument('--jitter', type=float, default=0.2, help='latency variation as a fraction of --latency')
+    parser.add_argument('--slow-rate', type=float, default=0.0, help='share of requests answered after --slow-latency')
+    parser.add_argument('--slow-latency', type=float, default=1.0)
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='share of requests that fail')
+    parser.add_argument('--failure-mode', choices=FAILURE_MODES, default='status')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    stub = StubUpstream(port=args.port, latency=args.latency, jitter=args.jitter, slow_rate=args.slow_rate,
+                        slow_latency=args.slow_latency, failure_rate=args.failure_rate,
+                        failure_mode=args.failure_mode, seed=args.seed)
+    print('Stub LMS/Attendance System listening; run the scraper with:')
+    print('  ' + ' '.join(f"{key}={value}" for key, value in stub.env.items()))
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stub.server.server_close()
+
+
+if __name__ == '__main__':
+    main()